@@ -1,5 +1,17 @@
+import os
+import time
 import wave
-import struct
+from typing import Callable
+
+from .funfest.pcm_cache import PCM_CACHE
+from .funfest.note_index import get_note_index
+from .funfest.sound_bank import SoundBank, BANK_FILEPATH
+from .funfest.stem_cache import STEM_CACHE, stem_key
+from .funfest.render_worker import RenderWorker
+from .funfest.stem_pool import StemPool
+from .funfest.render_engine import MixBus, iter_mix_blocks, set_backend, BLOCK_FRAMES
+from .funfest.fest_codec import FestState, decode_submessage, path_table
+from .funfest.metrics import METRICS
 
 ####### FUNFEST PROJECT ########
 # William and Cagatay, group 23
@@ -15,6 +27,63 @@ import struct
 FRAMERATE = 44100
 SAMPLE_LENGTH = 2 * FRAMERATE
 
+def load_bank(path: str = "rsrc_cache/" + BANK_FILEPATH) -> bool:
+    """
+    Opens the packed sound bank (see funfest/sound_bank.py), after which every fest asset is served
+    from that one memory-mapped file instead of separate wav files.
+
+    :returns whether a bank was loaded:
+    """
+    global _bank_signature
+    try:
+        bank = SoundBank(path)
+    except (OSError, ValueError) as error:
+        print("Sound bank not loaded:", error)
+        return False
+    PCM_CACHE.attach_bank(bank, "rsrc_cache")
+    _bank_signature = bank.signature
+    return True
+
+## (mtime_ns, size) of the bank file that was last mapped, or tried to
+_bank_signature = None
+
+def _ensure_bank():
+    """
+    Loads the bank once it has been downloaded, and again whenever the server sends a rebuilt one.
+    Until then the separate wav files are used.
+    """
+    global _bank_signature
+    try:
+        stat = os.stat("rsrc_cache/" + BANK_FILEPATH)
+    except OSError:
+        return
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if signature != _bank_signature and not load_bank():
+        # a broken bank is not retried until it changes
+        _bank_signature = signature
+
+## stem key last written to rsrc_cache/sound/fest/<tile_id>.wav, per tile id
+_written_stems: dict[str, str] = {}
+
+## fingerprint and frames of the last complete mix, and the slots it was written to
+_last_mix = {"hash": None, "frames": b"", "published": set()}
+
+## worker processes for instrument stems, see configure_stem_pool
+STEM_POOL = StemPool()
+
+def configure_stem_pool(workers: int | None = None, threshold: int | None = None):
+    """
+    :param workers: worker processes used to render instrument stems, 1 renders serially:
+    :param threshold: fewest uncached instrument stems worth sending to the pool:
+    """
+    STEM_POOL.configure(workers, threshold)
+
+## remembers what the last render mixed, so the next one only applies the difference
+_MIX_BUS = MixBus(SAMPLE_LENGTH)
+
+## the room's fest state as last received, deltas from the server are applied on top of it
+_FEST_STATE = FestState()
+
 ## can be overridden in case we decide to do theme changes.
 def get_timed_sequence(num) -> list[int]:
     """The purpose of this function is to add rhythm to a sequence of numbers
@@ -29,10 +98,26 @@ def get_timed_sequence(num) -> list[int]:
     if num & 2:
         return [SAMPLE_LENGTH // num] * num
     else:
-        temp = [FRAMERATE / 4] * num
+        temp = [FRAMERATE // 4] * num
         temp.append((SAMPLE_LENGTH // 8) * (8 - num))
         return temp
 
+def _render_instrument(message) -> bytes:
+    timed_sequence = get_timed_sequence(len(message[3])-1)
+    return get_note_index("rsrc_cache/" + message[2]).build(message[3], timed_sequence)
+
+def build_instrument(message) -> bytes:
+    """
+    Builds the frames of an instrument loop. Stems are memoized by (source sample, sequence, framerate),
+    so an unchanged instrument tile is served from the stem cache instead of being rendered again.
+
+    :param instrument message:
+    :returns raw 16bit mono frames:
+    """
+    path = "rsrc_cache/" + message[2]
+    key = stem_key(path, message[3], FRAMERATE, PCM_CACHE.source_signature(path))
+    return STEM_CACHE.get_or_render(key, lambda: _render_instrument(message))
+
 def parse(message) -> str:
     """
     First round of rendering, renders instrument loop.
@@ -47,70 +132,239 @@ def parse(message) -> str:
     ## probably wouldn't make sense to redefine the message data structure here so remember indexes:
     ## 0 -> type. 1 -> id. 2 -> path. 3-> sequence
 
-    timed_sequence = get_timed_sequence(len(message[3])-1)
+    path = "rsrc_cache/sound/fest/"+ message[1] + ".wav"
+    source = "rsrc_cache/" + message[2]
+    key = stem_key(source, message[3], FRAMERATE, PCM_CACHE.source_signature(source))
+
+    ## only rewrite the tile's file when its sequence actually changed
+    if _written_stems.get(message[1]) != key or not os.path.exists(path):
+        frames = build_instrument(message)
+
+        with wave.open(path, "wb") as output:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(FRAMERATE)
+            output.writeframes(frames)
+
+        _written_stems[message[1]] = key
+
+    return "fest/" + message[1] + ".wav"
 
-    with wave.open("rsrc_cache/" +message[2], "rb") as sample, wave.open("rsrc_cache/sound/fest/"+ message[1] + ".wav", "wb") as output:
+def mix(stems: list[bytes], divisor: int, backend: str | None = None) -> bytes:
+    """
+    One-shot mix of the given stems, see MixBus for the mixing policy.
+
+    :param stems: raw 16bit mono frames, one entry per child:
+    :param divisor: mixing divisor (the message length):
+    :param backend: render engine backend, defaults to the selected one:
+    :returns packed 16bit output frames:
+    """
+    bus = MixBus(SAMPLE_LENGTH, backend)
+    for i, frames in enumerate(stems):
+        bus.add(str(i), str(i), frames)
+    return bus.render(divisor)
+
+def set_render_backend(name: str):
+    """
+    Switches the render engine backend ("numpy", "array" or "reference"). The mix bus is rebuilt,
+    so the next render is a full one.
+    """
+    global _MIX_BUS
+    set_backend(name)
+    _MIX_BUS = MixBus(SAMPLE_LENGTH)
+
+def _collect_stems(message: dict) -> dict:
+    """
+    :param Fest message:
+    :returns child id -> (content key, source path, frame loader, instrument submessage or None)
+        for every child that produces sound:
+    """
+    wanted = {}
+    _ensure_bank()
+    paths = path_table(message)
+
+    for i in range(int(message['len'])):
+        submessage = decode_submessage(message[str(i)], paths)
+
+        if submessage[0] == "instrument" and len(submessage[3]) > 0:
+            path = "rsrc_cache/" + submessage[2]
+            signature = PCM_CACHE.source_signature(path)
+            wanted[submessage[1]] = (stem_key(path, submessage[3], FRAMERATE, signature), path,
+                                     lambda submessage=submessage: build_instrument(submessage), submessage)
+        elif submessage[0] == "loop":
+            path = "rsrc_cache/" + submessage[2]
+            signature = PCM_CACHE.source_signature(path)
+            ## decoded once per process, later renders are served from memory
+            wanted[submessage[1]] = (stem_key(path, "", FRAMERATE, signature), path,
+                                     lambda path=path: PCM_CACHE.get(path).readframes(0, SAMPLE_LENGTH), None)
+
+    return wanted
+
+def output_path(message: dict) -> str:
+    """
+    :param Fest message:
+    :returns the output slot the server will tell us to play. Older servers only know output.wav:
+    """
+    return "rsrc_cache/sound/" + message.get('slot', "fest/output.wav")
+
+def _apply_stem(stem_id: str, key: str, path: str, load: Callable) -> bool:
+    """
+    Swaps a stem on the mix bus, or takes it off if its files are missing.
+
+    :returns whether the stem made it onto the bus:
+    """
+    try:
+        _MIX_BUS.add(stem_id, key, load())
+    except FileNotFoundError:
+        ## send message back
+        print("Files Not found:", path)
+        ## can call getsound if this is in the client.
+        _MIX_BUS.remove(stem_id)
+        return False
+    except ValueError as error:
+        print("Invalid instrument:", error)
+        _MIX_BUS.remove(stem_id)
+        return False
+    return True
+
+def _publish(path: str, frames: bytes):
+    """ Written next to the slot, then published in one atomic rename: playback never sees a partial file. """
+    with wave.open(path + ".tmp", mode="wb") as output:
         output.setnchannels(1)
         output.setsampwidth(2)
         output.setframerate(FRAMERATE)
 
-        print(timed_sequence)
+        output.writeframes(frames)
 
-        for i in range(len(timed_sequence)):
-            sample.setpos((2 * FRAMERATE * (int(message[3][i]) - 1)))
-            output.writeframes(sample.readframes(int(timed_sequence[i])))
+    os.replace(path + ".tmp", path)
 
-    return "fest/" + message[1] + ".wav"
+def _render_instrument_job(message) -> bytes:
+    """ Runs in a StemPool worker process. """
+    _ensure_bank()
+    return _render_instrument(message)
+
+def _no_checkpoint():
+    pass
+
+def render(message: dict, checkpoint: Callable[[], None] = _no_checkpoint):
+    """
+    Applies a fest message, snapshot or delta, to the client's state and renders the result.
+    A delta that does not fit the current state is dropped, the next snapshot resynchronizes.
+
+    :param Fest message:
+    :param checkpoint: see _render_state:
+    :return void:
+    """
+    state = _FEST_STATE.apply(message)
+    if state is not None:
+        _render_state(state, checkpoint)
 
-def render(message: dict):
+def _render_state(message: dict, checkpoint: Callable[[], None] = _no_checkpoint):
     """
     Final render pass. Current mixing policy: divide by message length
 
+    Only the children that differ from the previous render are applied to the persistent mix bus:
+    removed tiles are subtracted, new ones added, and instruments whose sequence changed are swapped.
+
     :param Fest message:
-    :return void. note automatically renders to output.wav:
+    :param checkpoint: called between stems, may raise to abandon the render (see RenderWorker).
+        The bus stays consistent, the next render applies its diff from wherever this one stopped:
+    :return void. note automatically renders to the message's output slot:
     """
 
-    ## get files
-    amplitudes = [0] * SAMPLE_LENGTH
+    started = time.perf_counter() if METRICS.enabled else None
 
-    print(message)
+    ## same children as the last complete mix: nothing to mix, at most publish it into the new slot
+    path = output_path(message)
+    fingerprint = message.get('hash')
+    if fingerprint is not None and _last_mix["hash"] == fingerprint:
+        if path not in _last_mix["published"]:
+            _publish(path, _last_mix["frames"])
+            _last_mix["published"].add(path)
+        if started is not None:
+            METRICS.inc("render.skipped")
+        return
 
-    for i in range(int(message['len'])):
-        path = ""
-        submessage = message[str(i)].split(",")
+    wanted = _collect_stems(message)
+    complete = True
 
-        try:
-            print(submessage)
-            if submessage[0] == "instrument" and len(submessage[3]) > 0:
-                print(submessage[3])
-                path = parse(submessage)
-                path = "rsrc_cache/sound/" + path
-            elif submessage[0] == "loop":
-                path = submessage[2]
-                path = "rsrc_cache/" + path
+    for stem_id in _MIX_BUS.stem_ids() - wanted.keys():
+        _MIX_BUS.remove(stem_id)
 
-            with wave.open(path, 'rb') as current:
-                ## if instro -> render and return. if loop -> return path
+    changed = {stem_id: entry for stem_id, entry in wanted.items() if _MIX_BUS.key_of(stem_id) != entry[0]}
 
-                cur_frame = struct.unpack("<" + "h" * SAMPLE_LENGTH, current.readframes(SAMPLE_LENGTH))
-                amplitudes = [pair[0] + (pair[1] / int(message['len'])) for pair in zip(amplitudes, cur_frame)]
+    ## instruments that are not cached yet render in parallel, and are mixed as they come back
+    jobs = {stem_id: entry[3] for stem_id, entry in changed.items()
+            if entry[3] is not None and entry[0] not in STEM_CACHE}
+    for stem_id, future in STEM_POOL.run(_render_instrument_job, jobs):
+        key, source = changed.pop(stem_id)[:2]
+        checkpoint()
+        complete &= _apply_stem(stem_id, key, source, lambda: STEM_CACHE.get_or_render(key, future.result))
 
-            max_val = max(abs(sample) for sample in amplitudes)
-            if max_val > 32767:
-                amplitudes = [int(sample * 32767 / max_val) for sample in amplitudes]
+    for stem_id, (key, source, load, _) in changed.items():
+        checkpoint()
+        complete &= _apply_stem(stem_id, key, source, load)
 
-        except FileNotFoundError:
-            ## send message back
-            print("Files Not found:", path)
-            ## can call getsound if this is in the client.
-            pass
+    checkpoint()
+    frames = _MIX_BUS.render(int(message['len']))
+    _publish(path, frames)
+
+    ## a mix with missing files is redone once they arrive, even if the children are the same
+    _last_mix.update(hash=fingerprint if complete else None, frames=frames, published={path})
 
+    if started is not None:
+        METRICS.observe("render.seconds", time.perf_counter() - started)
 
-    packed_frames = [struct.pack("<h", int(sample)) for sample in amplitudes]
+def render_stream(message: dict, bars: int = 1, block_frames: int = BLOCK_FRAMES,
+                  path: str | None = None, checkpoint: Callable[[], None] = _no_checkpoint):
+    """
+    Streaming render pass, for loops longer than a single bar. Blocks are mixed and written one at a time,
+    and the wav header is final from the first block on, so playback can start while the rest is written.
 
-    with wave.open("rsrc_cache/sound/fest/output.wav", mode="wb") as output:
+    :param Fest message:
+    :param bars: output length, in SAMPLE_LENGTH bars:
+    :param block_frames: frames mixed per block:
+    :param path: output file, defaults to the message's output slot. Nobody plays that slot
+        while it is rendered, so it is written in place:
+    :param checkpoint: called between stems and blocks, may raise to abandon the render:
+    """
+    path = path or output_path(message)
+    stems = []
+    for key, source, load, _ in _collect_stems(message).values():
+        checkpoint()
+        try:
+            stems.append(load())
+        except FileNotFoundError:
+            print("Files Not found:", source)
+        except ValueError as error:
+            print("Invalid instrument:", error)
+
+    length = bars * SAMPLE_LENGTH
+
+    with open(path, "wb") as file, wave.open(file, mode="wb") as output:
         output.setnchannels(1)
         output.setsampwidth(2)
         output.setframerate(FRAMERATE)
+        ## known up front, so the header is never patched after the first block
+        output.setnframes(length)
+
+        for block in iter_mix_blocks(stems, int(message['len']), length, block_frames):
+            output.writeframesraw(block)
+            file.flush()
+            checkpoint()
+
+## renders in the background, the client's game loop only ever calls submit
+RENDER_WORKER = RenderWorker(_render_state)
+
+def submit(message: dict):
+    """
+    Non-blocking entry point for the client: queues the fest message for the background worker.
+    Bursts are coalesced and superseded renders are cancelled, only the newest state gets mixed.
+
+    :param Fest message:
+    """
+    ## deltas are applied here, in arrival order: the worker may skip states, so it only ever gets full ones
+    state = _FEST_STATE.apply(message)
+    if state is not None:
+        RENDER_WORKER.submit(state)
 
-        output.writeframes(b''.join(packed_frames))
\ No newline at end of file
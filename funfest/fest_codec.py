@@ -0,0 +1,144 @@
+import hashlib
+from typing import Iterable
+
+from .sound_assets import SOUND_FILEPATHS
+from .metrics import METRICS
+
+## FestMessage payload helpers shared by the server (fest_message.py) and the client (FestSoundCombiner).
+## Only uses the standard library, so the client can import it without the server modules.
+##
+## A payload is either a snapshot or a delta:
+##   snapshot: {"kind": "snapshot", "version", "len", "slot", "hash", "0".."n-1": submessage,
+##              "paths": path table, only in the first snapshot of a session}
+##   delta:    {"kind": "delta", "base", "version", "len", "slot", "hash",
+##              "added.<tile id>": submessage, "updated.<tile id>": submessage, "removed": "<tile id>,..."}
+## Payloads without a kind are snapshots from before versioning.
+##
+## A submessage is "<type><tile id>:<path index>[:<sequence>]", e.g. "i3:2:1357" or "l-1:16":
+##   type      "l" for a loop, "i" for an instrument
+##   path      index into the path table, SOUND_FILEPATHS unless the session sent its own
+##   sequence  scale degrees 1-8, one digit each
+## The older "instrument,<tile id>,<path>,<sequence>" and "loop,<tile id>,<path>" strings still decode.
+
+TYPES = {"l": "loop", "i": "instrument"}
+TYPE_CODES = {name: code for code, name in TYPES.items()}
+PATH_SEPARATOR = "\n"
+_PATH_INDEXES = {path: index for index, path in enumerate(SOUND_FILEPATHS)}
+
+
+def encode_submessage(kind: str, tile_id: int, path: str, sequence: str | None = None) -> str:
+    """
+    :param kind: "loop" or "instrument":
+    :param path: sound path, must be in SOUND_FILEPATHS:
+    :param sequence: instruments only, digits 1-8:
+    :returns the compact submessage:
+    """
+    if path not in _PATH_INDEXES:
+        raise ValueError(f"{path} is not in SOUND_FILEPATHS")
+    data = TYPE_CODES[kind] + str(tile_id) + ":" + str(_PATH_INDEXES[path])
+    if sequence is not None:
+        data += ":" + sequence
+    return data
+
+
+def decode_submessage(data: str, paths: list[str] = SOUND_FILEPATHS) -> list[str]:
+    """
+    :param data: compact or comma separated submessage:
+    :param paths: the session's path table:
+    :returns [type, tile id, path, sequence], the sequence only for instruments:
+    """
+    if "," in data:
+        return data.split(",")
+
+    fields = data[1:].split(":")
+    fields[1] = paths[int(fields[1])]
+    return [TYPES[data[0]]] + fields
+
+
+def encode_paths(paths: list[str] = SOUND_FILEPATHS) -> str:
+    return PATH_SEPARATOR.join(paths)
+
+
+def path_table(message: dict) -> list[str]:
+    """ :returns the path table a payload's submessages refer to: """
+    if "paths" in message:
+        return message["paths"].split(PATH_SEPARATOR)
+    return SOUND_FILEPATHS
+
+
+def fingerprint(children: Iterable[str]) -> str:
+    """
+    Stable content hash of serialized submessages (type, id, path and sequence), independent of their order.
+
+    :param children: submessages as produced by FestSubMessage._get_data:
+    :returns hex digest:
+    """
+    return hashlib.sha1("\n".join(sorted(children)).encode()).hexdigest()[:16]
+
+
+def child_id(data: str) -> str:
+    """ :returns the tile id of a serialized submessage: """
+    if "," in data:
+        return data.split(",")[1]
+    return data[1:data.index(":")]
+
+
+class FestState:
+    """
+    Client side copy of the room's fest state. Snapshots replace it, deltas are applied on top of it.
+    A delta that does not start from our version (a gap), or that leads to a state whose fingerprint
+    differs from the server's, is rejected: the state is kept and the next snapshot resynchronizes it.
+    """
+
+    def __init__(self):
+        self.version: int | None = None
+        self.children: dict[str, str] = {}
+        ## sent once per session, with the first snapshot
+        self.paths: list[str] = SOUND_FILEPATHS
+
+    def apply(self, message: dict) -> dict | None:
+        """
+        :param message: FestMessage payload:
+        :returns the resulting full state as a snapshot payload, None if the delta could not be applied:
+        """
+        if message.get("kind", "snapshot") == "snapshot":
+            children = {}
+            for i in range(int(message["len"])):
+                children[child_id(message[str(i)])] = message[str(i)]
+        else:
+            ## a rejected delta leaves the old mix playing until the next keyframe, see KEYFRAME_INTERVAL
+            if message["base"] != self.version:
+                if METRICS.enabled:
+                    METRICS.inc("fest.delta_rejected")
+                return None
+
+            children = dict(self.children)
+            for tile_id in filter(None, message.get("removed", "").split(",")):
+                children.pop(tile_id, None)
+            for key, data in message.items():
+                if key.startswith(("added.", "updated.")):
+                    children[key.split(".", 1)[1]] = data
+
+            if "hash" in message and fingerprint(children.values()) != message["hash"]:
+                if METRICS.enabled:
+                    METRICS.inc("fest.delta_rejected")
+                return None
+
+        if "paths" in message:
+            paths = path_table(message)
+            self.paths = SOUND_FILEPATHS if paths == SOUND_FILEPATHS else paths
+        self.version = message.get("version")
+        self.children = children
+        return self.snapshot(message.get("slot"), message.get("hash"))
+
+    def snapshot(self, slot: str | None = None, state_hash: str | None = None) -> dict:
+        temp = {"kind": "snapshot", "version": self.version, "len": len(self.children), "classname": "FestMessage"}
+        if slot is not None:
+            temp["slot"] = slot
+        if state_hash is not None:
+            temp["hash"] = state_hash
+        if self.paths is not SOUND_FILEPATHS:
+            temp["paths"] = encode_paths(self.paths)
+        for i, data in enumerate(self.children.values()):
+            temp[str(i)] = data
+        return temp
@@ -1,5 +1,9 @@
 from ..imports import *
+import json
 from abc import ABC
+from collections import deque
+from .fest_codec import fingerprint, encode_submessage, encode_paths
+from .metrics import METRICS, BYTE_BOUNDS
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -8,6 +12,15 @@ if TYPE_CHECKING:
 FRAMERATE = 44100
 SAMPLE_LENGTH = FRAMERATE * 2
 
+## the client renders into alternating slots, so the next mix never overwrites the one being played
+OUTPUT_SLOTS = 2
+## changes remembered for deltas; a recipient further behind than this gets a full snapshot
+DELTA_HISTORY = 64
+## broadcasts between full snapshots to every player, which resynchronize clients that rejected a delta.
+## A client that rejects one waits at most KEYFRAME_INTERVAL * BROADCAST_INTERVAL for the next snapshot,
+## 20 * 0.5 s = 10 s at the defaults, longer while the scheduler backs off
+KEYFRAME_INTERVAL = 20
+
 
 class FestSubMessage(ABC):
 
@@ -25,19 +38,17 @@ class LoopMessage(FestSubMessage):
     def __init__(self, path: str, tile_id: int):
         self.__tile_id = tile_id
         self.__path = path
-        print(self.__path)
 
     def get_id(self) -> int:
         return self.__tile_id
 
     def _get_data(self)-> dict[str:str]:
-        return "loop," + str(self.__tile_id) + "," + self.__path
-            ## must be a string, so will have to later break it up
+        return encode_submessage("loop", self.__tile_id, self.__path)
+            ## must be a string, so will have to later break it up (see fest_codec)
 
 
 class InstrumentMessage(FestSubMessage):
     def __init__(self, path, tile_id, sequence):
-        print("INITIATING INSTRO")
         self.__path = path
         self.sequence = sequence
         self.__tile_id = tile_id
@@ -46,7 +57,7 @@ class InstrumentMessage(FestSubMessage):
         return self.__tile_id
 
     def _get_data(self)-> dict[str:str]:
-        return "instrument," + str(self.__tile_id) + "," + self.__path + "," + str(self.sequence)
+        return encode_submessage("instrument", self.__tile_id, self.__path, str(self.sequence))
 
     def update_sequence(self, new_sequence):
         self.sequence = new_sequence
@@ -61,11 +72,19 @@ class FestMessage(Message, SenderInterface):
 
     def __init__(self, recipient: RecipientInterface):
         super().__init__(self, recipient)
-        ## alternate data structures:
-        ## heap, hashmap (for checking)
-        ## Composite had two functions: check if there has been a change, add/remove value,
-        self.__children = []
-        self.__length = 0
+        ## Composite had two functions: check if there has been a change, add/remove value.
+        ## children are keyed by tile id, dicts keep insertion order so the payload order is stable
+        self.__children: dict[int, FestSubMessage] = {}
+        self.__slot = 0
+        ## serialized payload and fingerprint, rebuilt only after a mutation
+        self.__payload: dict[str, str] | None = None
+        self.__fingerprint: str | None = None
+        ## every mutation bumps the version and logs (version, tile id, "add" | "update" | "remove"),
+        ## or (version, None, "slot") for a slot change
+        self.__version = 0
+        self.__history: deque[tuple[int, int, str]] = deque(maxlen=DELTA_HISTORY)
+        ## payloads per base version, None being the snapshot with the path table for joining players
+        self.__deltas: dict[int | None, dict[str, str]] = {}
         self.dirty = False
 
         self.add(ambient)
@@ -77,78 +96,149 @@ class FestMessage(Message, SenderInterface):
     def get_name(self):
         return "***SERVER***"
 
-    def _get_data(self) -> dict[str, str]:
-        temp = {"len": self.__length, "classname": "FestMessage"}
-
-        ## init iterator
-        i = 0
-
-        for submessage in self.__children:
-            # message entries have to be easily accessed, e.g. sequentially in sound combiner.
-            # however they are not stored that way in fest_message
-
-            ## Polymorphism does not work properly? Probably a problem with my limited python knowledge
-
-            temp[str(i)] = submessage._get_data()
-
-            print(i)
-            i+=1
+    def __changed(self, tile_id: int | None, operation: str):
+        self.__version += 1
+        self.__history.append((self.__version, tile_id, operation))
+        self.__payload = None
+        self.__fingerprint = None
+        self.__deltas.clear()
+        self.dirty = True
 
-        print(temp)
-        return temp
+    def version(self) -> int:
+        return self.__version
 
-    def add_recipient(self, recipient: RecipientInterface) -> Message:
-        copy = FestMessage(recipient)
-        ## I lowkey don't care if this means children can be changed.
-        copy.__children = self.__children
-        copy.__length = self.__length
+    def _get_data(self) -> dict[str, str]:
+        if self.__payload is None:
+            temp = {"kind": "snapshot", "version": self.__version, "len": len(self.__children), "classname": "FestMessage",
+                    "slot": self.get_slot(), "hash": self.fingerprint()}
 
-        return copy
+            # message entries have to be easily accessed, e.g. sequentially in sound combiner.
+            for i, submessage in enumerate(self.__children.values()):
+                temp[str(i)] = submessage._get_data()
+
+            self.__payload = temp
+            if METRICS.enabled:
+                METRICS.observe("fest.snapshot_bytes", len(json.dumps(temp)), BYTE_BOUNDS)
+        return self.__payload
+
+    def payload_for(self, base: int | None) -> dict[str, str]:
+        """
+        :param base: version the recipient last received, None if it has nothing yet:
+        :returns a delta from that version, or a full snapshot if the history no longer reaches back to it:
+        """
+        if base is not None and (base > self.__version or (base < self.__version and (
+                not self.__history or self.__history[0][0] > base + 1))):
+            return self._get_data()
+
+        if base is None:
+            ## a player starting from nothing also needs the table the submessages' path indexes refer to
+            if None not in self.__deltas:
+                self.__deltas[None] = dict(self._get_data(), paths=encode_paths())
+            return self.__deltas[None]
+
+        if base not in self.__deltas:
+            first_operation = {}
+            for version, tile_id, operation in self.__history:
+                ## slot changes have no tile, every payload carries the current slot
+                if version > base and tile_id is not None:
+                    first_operation.setdefault(tile_id, operation)
+
+            temp = {"kind": "delta", "base": base, "version": self.__version, "len": len(self.__children),
+                    "classname": "FestMessage", "slot": self.get_slot(), "hash": self.fingerprint()}
+            removed = []
+            for tile_id, operation in first_operation.items():
+                child = self.__children.get(tile_id)
+                ## a child that was added after base is new to the recipient, anything else it already knows
+                if child is None:
+                    if operation != "add":
+                        removed.append(str(tile_id))
+                elif operation == "add":
+                    temp["added." + str(tile_id)] = child._get_data()
+                else:
+                    temp["updated." + str(tile_id)] = child._get_data()
+            temp["removed"] = ",".join(removed)
+
+            self.__deltas[base] = temp
+            if METRICS.enabled:
+                METRICS.observe("fest.delta_bytes", len(json.dumps(temp)), BYTE_BOUNDS)
+        return self.__deltas[base]
+
+    def add_recipient(self, recipient: RecipientInterface, base: int | None = None) -> Message:
+        """
+        :param recipient: player to send the state to:
+        :param base: version the recipient last received, None (e.g. a player that just joined) for a snapshot:
+        :returns an envelope for the recipient. Recipients at the same version share one serialized payload:
+        """
+        return FestBroadcast(self, recipient, self.payload_for(base))
+
+    def fingerprint(self) -> str:
+        """
+        Stable content hash of the children (type, id, path and sequence), independent of their order.
+        Clients skip rendering a state whose fingerprint they already mixed.
+        """
+        if self.__fingerprint is None:
+            self.__fingerprint = fingerprint(submessage._get_data() for submessage in self.__children.values())
+        return self.__fingerprint
+
+    def get_slot(self) -> str:
+        """ Sound path the client renders this state into, relative to the sound folder. """
+        return "fest/output-" + str(self.__slot) + ".wav"
+
+    def next_slot(self) -> str:
+        """
+        Moves on to the other output slot, called once per broadcast of a new state.
+        The slot is part of the versioned state, so every player, including one that got the state before
+        it was published, is sent the new slot before being told to play it.
+        """
+        self.__slot = (self.__slot + 1) % OUTPUT_SLOTS
+        self.__changed(None, "slot")
+        return self.get_slot()
 
     def remove_tile(self, tile_id: int):
-        for i, submessage in enumerate(self.__children):
-            if submessage.get_id() == tile_id:
-                self.__children.pop(i)
-                self.__length -= 1
-                self.dirty = True
-                break
+        if self.__children.pop(tile_id, None) is not None:
+            self.__changed(tile_id, "remove")
 
     def length(self) -> int:
-        return self.__length
+        return len(self.__children)
 
     def make_dirty(self):
         self.dirty = True
 
     def add(self, child: FestSubMessage):
-        new = True
-        for existing in self.__children:
-            if child.get_id() == existing.get_id():
-                ## if the ids are the same, theyre the same type
-                if isinstance(child, InstrumentMessage):
-                    existing.update_sequence(child.sequence)
-                new = False
-                break
-        if new:
-            self.dirty = True
-            self.__children.append(child)
-            self.__length += 1
-
-
-    def remove(self, child):
-        self.dirty = True
-        self.__children.remove(child)
-        ## add checks. im not sure about the id system
+        """ Adds a child, or updates the sequence of the instrument with the same tile id. """
+        existing = self.__children.get(child.get_id())
+        if existing is None:
+            self.__children[child.get_id()] = child
+            self.__changed(child.get_id(), "add")
+        ## if the ids are the same, theyre the same type
+        elif isinstance(child, InstrumentMessage) and existing.sequence != child.sequence:
+            existing.update_sequence(child.sequence)
+            self.__changed(child.get_id(), "update")
+
+    def remove(self, child: FestSubMessage):
+        self.remove_tile(child.get_id())
 
     def clear(self):
-        for key in self:
-            self.remove(key)
+        for child in list(self):
+            self.remove(child)
 
     def __iter__(self):
-        self.count = 0
-        return self.__children[self.count]
-
-    def __next__(self):
-        if self.count >= self.__length:
-            raise StopIteration
-        self.count += 1
-        return self.__children[self.count]
\ No newline at end of file
+        return iter(self.__children.values())
+
+    def __contains__(self, tile_id: int) -> bool:
+        return tile_id in self.__children
+
+
+class FestBroadcast(Message):
+    """
+    One recipient's copy of a FestMessage payload. The payload is serialized once per state and shared
+    by every envelope, so fanning a tick out to N players costs N envelopes, not N serializations.
+    Payloads are shared: never mutate the dict returned by _get_data.
+    """
+
+    def __init__(self, sender: FestMessage, recipient: RecipientInterface, payload: dict[str, str]):
+        super().__init__(sender, recipient)
+        self.__payload = payload
+
+    def _get_data(self) -> dict[str, str]:
+        return self.__payload
@@ -0,0 +1,87 @@
+import time
+from typing import Callable
+
+## Paces the fest room independently of the server's tick rate: how often state goes out,
+## how often a new state may make clients re-render, and how often the mix is replayed.
+
+BROADCAST_INTERVAL = 0.5
+MIN_RENDER_INTERVAL = 1.0
+COALESCE_WINDOW = 0.25
+## one bar of the mix
+PLAY_INTERVAL = 2.0
+TICK_BUDGET = 0.02
+MAX_BACKOFF = 8.0
+
+
+class FestScheduler:
+    """
+    Decides, per tick, whether to broadcast, publish a new state and replay the mix.
+
+    Tile and sequence changes are coalesced: a new state is only published once the first pending change
+    is `coalesce_window` old, and at most every `min_render_interval`, so a burst of edits costs clients one render.
+    Ticks that run over `tick_budget` double a backoff factor (up to `max_backoff`) that stretches the broadcast
+    and render intervals; ticks within budget halve it again.
+    """
+
+    def __init__(self, broadcast_interval: float = BROADCAST_INTERVAL, min_render_interval: float = MIN_RENDER_INTERVAL,
+                 coalesce_window: float = COALESCE_WINDOW, play_interval: float = PLAY_INTERVAL,
+                 tick_budget: float = TICK_BUDGET, max_backoff: float = MAX_BACKOFF,
+                 clock: Callable[[], float] = time.monotonic):
+        self.broadcast_interval = broadcast_interval
+        self.min_render_interval = min_render_interval
+        self.coalesce_window = coalesce_window
+        self.play_interval = play_interval
+        self.tick_budget = tick_budget
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.backoff = 1.0
+        self.__last_broadcast: float | None = None
+        self.__last_render: float | None = None
+        self.__last_play: float | None = None
+        self.__pending_since: float | None = None
+
+    def configure(self, **settings):
+        """ Changes any of the constructor's intervals or limits. """
+        for name, value in settings.items():
+            if not hasattr(self, name) or name in ("clock", "backoff"):
+                raise TypeError(f"FestScheduler has no setting {name}")
+            setattr(self, name, value)
+
+    def now(self) -> float:
+        return self.clock()
+
+    def broadcast_due(self, now: float) -> bool:
+        """ Whether this tick sends state to players who are behind. Counts as the broadcast when True. """
+        if self.__last_broadcast is not None and now - self.__last_broadcast < self.broadcast_interval * self.backoff:
+            return False
+        self.__last_broadcast = now
+        return True
+
+    def note_change(self, now: float):
+        """ The room's state differs from the published one. Only the first change of a window is remembered. """
+        if self.__pending_since is None:
+            self.__pending_since = now
+
+    def render_due(self, now: float) -> bool:
+        """ Whether the pending changes may be published now. Counts as the publication when True. """
+        if self.__pending_since is None or now - self.__pending_since < self.coalesce_window:
+            return False
+        if self.__last_render is not None and now - self.__last_render < self.min_render_interval * self.backoff:
+            return False
+        self.__last_render = now
+        self.__pending_since = None
+        return True
+
+    def play_due(self, now: float) -> bool:
+        """ Whether the mix is replayed this tick. Counts as the replay when True. """
+        if self.__last_play is not None and now - self.__last_play < self.play_interval:
+            return False
+        self.__last_play = now
+        return True
+
+    def end_tick(self, duration: float):
+        """ :param duration: seconds the tick took, adapts the backoff: """
+        if duration > self.tick_budget:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+        else:
+            self.backoff = max(self.backoff / 2, 1.0)
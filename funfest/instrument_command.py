@@ -21,13 +21,15 @@ class ClearSequence(ChatCommand):
         tile_id, tile, _ = None, None, None
 
         if hasattr(context, 'tile_map'):
-            result = context.tile_map.check_player_position(player)
+            result = context.tile_map.get_player_tile(player)
             if result:
                 tile_id, tile, _ = result
 
         if tile and tile.is_number_sequence_tile:
-            tile.clear_sequence()
-            if not tile.get_stored_sequence:
+            context.tile_map.clear_stored_sequence(tile)
+            if hasattr(context, 'on_sequence_update'):
+                context.on_sequence_update(tile)
+            if not context.tile_map.get_stored_sequence(tile):
                 messages.append(ServerMessage(player, f"Successfully cleared tile {tile_id}'s sequence!"))
             else:
                 messages.append(ServerMessage(player, f"Unsuccess."))
@@ -48,7 +50,7 @@ class AddToSequence(ChatCommand):
         tile_id, tile, _ = None, None, None
 
         if hasattr(context, 'tile_map'):
-            result = context.tile_map.check_player_position(player)
+            result = context.tile_map.get_player_tile(player)
             if result:
                 tile_id, tile, _ = result
 
@@ -56,8 +58,10 @@ class AddToSequence(ChatCommand):
             if command_text.isdigit():
                 number = int(command_text)
                 if 1 <= number <= 8:
-                    tile.store_number(number)
-                    messages.append(ServerMessage(player, f"You entered {number}; tile {tile_id} sequence: {tile.get_stored_sequence()}"))
+                    context.tile_map.store_number(tile, number)
+                    if hasattr(context, 'on_sequence_update'):
+                        context.on_sequence_update(tile)
+                    messages.append(ServerMessage(player, f"You entered {number}; tile {tile_id} sequence: {context.tile_map.get_stored_sequence(tile)}"))
                 else:
                     messages.append(ServerMessage(player, "Invalid. Enter 1-8."))
 
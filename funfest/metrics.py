@@ -0,0 +1,99 @@
+import os
+import time
+from bisect import bisect_left
+from typing import Callable
+
+## Counters and histograms for the fest server tick and the client renderer.
+## Disabled by default: instrumented code checks METRICS.enabled before measuring anything,
+## so a disabled registry costs one attribute lookup per call site.
+## Enable with FEST_METRICS=1, or METRICS.configure(enabled=True).
+
+## seconds, fits tick and render times
+DEFAULT_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BYTE_BOUNDS = (64, 256, 1024, 4096, 16384, 65536)
+COUNT_BOUNDS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+class Histogram:
+    """ Count, sum, min, max and fixed buckets, each bucket counting the values <= its bound. """
+
+    def __init__(self, bounds: tuple = DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def snapshot(self) -> dict:
+        labels = [str(bound) for bound in self.bounds] + ["inf"]
+        return {"count": self.count, "sum": self.total, "min": self.min, "max": self.max,
+                "buckets": dict(zip(labels, self.buckets))}
+
+
+class Metrics:
+    """
+    Named counters and histograms, created on first use.
+    Snapshots are exported every `interval` seconds to the registered callbacks, see tick().
+    """
+
+    def __init__(self, enabled: bool = False, interval: float = 10.0):
+        self.enabled = enabled
+        self.interval = interval
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.__callbacks: list[Callable[[dict], None]] = []
+        self.__last_export = time.monotonic()
+
+    def configure(self, enabled: bool | None = None, interval: float | None = None,
+                  callback: Callable[[dict], None] | None = None):
+        """
+        :param enabled: turns collection on or off:
+        :param interval: seconds between exported snapshots:
+        :param callback: receives every exported snapshot:
+        """
+        if enabled is not None:
+            self.enabled = enabled
+        if interval is not None:
+            self.interval = interval
+        if callback is not None:
+            self.__callbacks.append(callback)
+
+    def inc(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float, bounds: tuple = DEFAULT_BOUNDS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        return {"counters": dict(self.counters),
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()}}
+
+    def tick(self):
+        """ Called once per update: exports a snapshot when the interval has passed. """
+        if not self.enabled or not self.__callbacks:
+            return
+        now = time.monotonic()
+        if now - self.__last_export >= self.interval:
+            self.__last_export = now
+            snapshot = self.snapshot()
+            for callback in self.__callbacks:
+                callback(snapshot)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+
+## shared by the server and the client in one process
+METRICS = Metrics(enabled=os.environ.get("FEST_METRICS", "") not in ("", "0"))
@@ -0,0 +1,64 @@
+from .pcm_cache import PCM_CACHE, PCMAsset
+
+## Instrument samples (i1.wav ... i4.wav) hold an ascending scale: 8 notes, two seconds each.
+
+FRAMERATE = 44100
+NOTE_COUNT = 8
+NOTE_LENGTH = 2 * FRAMERATE
+
+
+class NoteIndex:
+    """ One zero-copy view per scale degree of an instrument sample, built once per decoded asset. """
+
+    def __init__(self, asset: PCMAsset, note_length: int = NOTE_LENGTH, note_count: int = NOTE_COUNT):
+        if asset.nchannels != 1 or asset.sampwidth != 2:
+            raise ValueError(f"{asset.path}: instrument samples must be 16bit mono")
+        if asset.nframes <= (note_count - 1) * note_length:
+            raise ValueError(f"{asset.path}: {asset.nframes} frames cannot hold {note_count} notes")
+
+        self.asset = asset
+        self.note_length = note_length
+        self.__notes = [asset.readframes(note_length * i, note_length) for i in range(note_count)]
+
+        ## the last note of the shipped samples is a few hundred frames short
+        self.short_notes = [degree for degree, view in enumerate(self.__notes, 1) if len(view) < 2 * note_length]
+
+    def __len__(self) -> int:
+        return len(self.__notes)
+
+    def note(self, degree: int, count: int):
+        """
+        :param degree: scale degree, 1 to 8:
+        :param count: frames to hold the note for:
+        :returns the first `count` frames of the note, padded with silence if the note is shorter:
+        """
+        if not 1 <= degree <= len(self.__notes):
+            raise ValueError(f"note {degree} is not in the scale")
+
+        view = self.__notes[degree - 1][:2 * count]
+        if len(view) < 2 * count:
+            return bytes(view) + bytes(2 * count - len(view))
+        return view
+
+    def build(self, sequence: str, timings: list[int]) -> bytes:
+        """
+        Concatenates the notes of a sequence.
+
+        :param sequence: digits, one scale degree each:
+        :param timings: frames per note, see get_timed_sequence:
+        :returns raw 16bit mono frames:
+        """
+        return b"".join(self.note(int(degree), count) for degree, count in zip(sequence, timings))
+
+
+_indexes: dict[str, NoteIndex] = {}
+
+
+def get_note_index(path: str) -> NoteIndex:
+    """ :returns the index of an instrument sample, rebuilt only when the decoded asset changed: """
+    asset = PCM_CACHE.get(path)
+    index = _indexes.get(path)
+    if index is None or index.asset is not asset:
+        index = NoteIndex(asset)
+        _indexes[path] = index
+    return index
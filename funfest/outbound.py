@@ -0,0 +1,88 @@
+from collections import deque
+from typing import Callable
+
+from .metrics import METRICS, COUNT_BOUNDS
+
+## Per-client outbound slots for the fest room. Every kind of message ("preload <path>", "state", "play") has one
+## slot that only keeps the newest unsent message, so a slow client never builds up a backlog of stale jams.
+
+## state messages a client may be rendering at once
+MAX_IN_FLIGHT = 1
+## seconds after which a state message counts as consumed. Clients cannot reply, so this is an estimate
+SETTLE_TIME = 1.0
+
+
+class ClientOutbox:
+    """
+    Latest-wins slots for one client, with backpressure on state messages: while `max_in_flight` of them
+    are unsettled, newer states wait in their slot, replacing each other, instead of being sent.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, settle_time: float = SETTLE_TIME,
+                 limited: tuple[str, ...] = ("state",)):
+        """
+        :param limited: kinds that count as in flight, the other kinds are sent on the next drain:
+        """
+        self.max_in_flight = max_in_flight
+        self.settle_time = settle_time
+        self.limited = limited
+        ## kind -> (message, key, called once it is sent)
+        self.__pending: dict[str, tuple[object, object, Callable[[], None] | None]] = {}
+        ## send times of the unsettled limited messages
+        self.__in_flight: deque[float] = deque()
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, kind: str, message, on_send: Callable[[], None] | None = None, key=None):
+        """
+        :param kind: slot, a newer message replaces the unsent one of the same kind:
+        :param on_send: called when the message is actually handed out, e.g. to record what the client has:
+        :param key: identifies the content, offering the same key again keeps the pending message:
+        """
+        pending = self.__pending.get(kind)
+        if pending is not None:
+            if key is not None and pending[1] == key:
+                return
+            self.dropped += 1
+            if METRICS.enabled:
+                METRICS.inc("outbound.dropped." + kind)
+        self.__pending[kind] = (message, key, on_send)
+
+    def pending(self, kind: str) -> bool:
+        return kind in self.__pending
+
+    def acknowledge(self):
+        """ The client consumed its oldest state message. Unused until clients have a reply channel. """
+        if self.__in_flight:
+            self.__in_flight.popleft()
+
+    def in_flight(self, now: float) -> int:
+        while self.__in_flight and now - self.__in_flight[0] >= self.settle_time:
+            self.__in_flight.popleft()
+        return len(self.__in_flight)
+
+    def drain(self, now: float) -> list:
+        """ :returns the messages to send this tick, oldest slot first: """
+        messages = []
+        in_flight = self.in_flight(now)
+        for kind in list(self.__pending):
+            if kind in self.limited:
+                if in_flight >= self.max_in_flight:
+                    continue
+                in_flight += 1
+                self.__in_flight.append(now)
+
+            message, _, on_send = self.__pending.pop(kind)
+            if on_send is not None:
+                on_send()
+            messages.append(message)
+
+        self.sent += len(messages)
+        if METRICS.enabled:
+            METRICS.observe("outbound.queue_depth", len(self.__pending), COUNT_BOUNDS)
+            METRICS.observe("outbound.in_flight", in_flight, COUNT_BOUNDS)
+        return messages
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": len(self.__pending), "in_flight": len(self.__in_flight),
+                "sent": self.sent, "dropped": self.dropped}
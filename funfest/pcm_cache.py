@@ -0,0 +1,205 @@
+import os
+import mmap
+import wave
+import struct
+from collections import OrderedDict
+
+## Process wide cache of decoded fest sound assets. Only uses the standard library,
+## since it runs on the client next to FestSoundCombiner.
+
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+
+class PCMAsset:
+    """ Decoded frames of a single wav file, held as a read-only buffer. """
+
+    def __init__(self, path: str, nchannels: int, sampwidth: int, framerate: int, frames: memoryview, mapped: bool):
+        self.path = path
+        self.nchannels = nchannels
+        self.sampwidth = sampwidth
+        self.framerate = framerate
+        self.frames = frames
+        self.mapped = mapped
+
+    @property
+    def frame_width(self) -> int:
+        return self.nchannels * self.sampwidth
+
+    @property
+    def nframes(self) -> int:
+        return len(self.frames) // self.frame_width
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.frames)
+
+    def readframes(self, start: int, count: int) -> memoryview:
+        """ Zero-copy equivalent of setpos(start) followed by readframes(count). """
+        width = self.frame_width
+        return self.frames[start * width:(start + count) * width]
+
+
+def _find_data_chunk(buffer) -> tuple[int, int]:
+    """
+    Walks the RIFF chunks of a wav file and locates the sample data.
+
+    :param buffer: the whole file:
+    :returns (offset, size) of the data chunk:
+    """
+    if buffer[0:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        raise wave.Error("file does not start with RIFF/WAVE id")
+
+    offset = 12
+    while offset + 8 <= len(buffer):
+        chunk_id = buffer[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", buffer, offset + 4)[0]
+        offset += 8
+        if chunk_id == b"data":
+            return offset, min(chunk_size, len(buffer) - offset)
+        # chunks are padded to an even size
+        offset += chunk_size + (chunk_size & 1)
+
+    raise wave.Error("data chunk not found")
+
+
+def load_asset(path: str) -> PCMAsset:
+    """
+    Decodes a wav file. The sample data is memory-mapped when possible, otherwise it is
+    read once into an immutable bytes object.
+    """
+    with wave.open(path, "rb") as sample:
+        nchannels = sample.getnchannels()
+        sampwidth = sample.getsampwidth()
+        framerate = sample.getframerate()
+        nframes = sample.getnframes()
+
+        try:
+            with open(path, "rb") as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            offset, size = _find_data_chunk(mapping)
+            size = min(size, nframes * nchannels * sampwidth)
+            frames = memoryview(mapping)[offset:offset + size]
+            mapped = True
+        except (OSError, ValueError, wave.Error):
+            frames = memoryview(sample.readframes(nframes))
+            mapped = False
+
+    return PCMAsset(path, nchannels, sampwidth, framerate, frames.toreadonly(), mapped)
+
+
+class PCMCache:
+    """
+    LRU cache of decoded assets keyed by path, mtime and size, bounded by a byte budget.
+    A changed file on disk is a miss and replaces the stale entry.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET):
+        self.max_bytes = max_bytes
+        self.__entries: OrderedDict[str, tuple[tuple[int, int], PCMAsset]] = OrderedDict()
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__bank = None
+        self.__bank_root = None
+
+    def attach_bank(self, bank, root: str):
+        """
+        Serves the assets of a sound bank (see sound_bank.SoundBank) instead of their wav files,
+        except for a wav modified after the bank was built, which is decoded as usual.
+
+        :param bank: the opened bank, None to detach:
+        :param root: folder the bank's asset paths are relative to, e.g. rsrc_cache:
+        """
+        self.__bank = bank
+        self.__bank_root = os.path.abspath(root)
+
+    def get(self, path: str) -> PCMAsset:
+        """
+        :param path: wav file path:
+        :returns the decoded asset. Raises FileNotFoundError like wave.open would:
+        """
+        path = os.path.abspath(path)
+        asset = self.__bank_asset(path)
+        if asset is not None:
+            self.hits += 1
+            return asset
+
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self.__entries.get(path)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            self.__entries.move_to_end(path)
+            return entry[1]
+
+        self.misses += 1
+        if entry is not None:
+            self.__discard(path)
+
+        asset = load_asset(path)
+        self.__entries[path] = (signature, asset)
+        self.__bytes += asset.nbytes
+        self.__evict()
+        return asset
+
+    def source_signature(self, path: str) -> str:
+        """
+        Identifies the content get(path) serves, for keys derived from it: the bank's mtime and size
+        when the bank serves the asset, otherwise the wav file's, or "missing".
+        """
+        path = os.path.abspath(path)
+        if self.__bank_asset(path) is not None:
+            return "bank:{}:{}".format(*self.__bank.signature)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "missing"
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def __bank_asset(self, path: str) -> PCMAsset | None:
+        """ :param path: absolute wav file path: """
+        if self.__bank is None:
+            return None
+        asset = self.__bank.get(os.path.relpath(path, self.__bank_root).replace(os.sep, "/"))
+        if asset is not None:
+            try:
+                if os.stat(path).st_mtime_ns > self.__bank.signature[0]:
+                    return None
+            except OSError:
+                pass
+        return asset
+
+    def __discard(self, path: str):
+        _, asset = self.__entries.pop(path)
+        self.__bytes -= asset.nbytes
+
+    def __evict(self):
+        # always keep the most recent asset, even if it alone exceeds the budget
+        while self.__bytes > self.max_bytes and len(self.__entries) > 1:
+            self.__discard(next(iter(self.__entries)))
+            self.evictions += 1
+
+    def invalidate(self, path: str):
+        path = os.path.abspath(path)
+        if path in self.__entries:
+            self.__discard(path)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.abspath(path) in self.__entries
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.__entries), "bytes": self.__bytes, "max_bytes": self.max_bytes}
+
+
+## shared by every render in the process
+PCM_CACHE = PCMCache()
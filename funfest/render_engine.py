@@ -0,0 +1,276 @@
+"""
+The fest render engine: mixing backends, the persistent mix bus and the streaming mixer.
+
+Every backend implements the same mixing policy on raw 16bit mono frames, and is picked at runtime with
+set_backend (or the FEST_RENDER_BACKEND environment variable):
+    numpy       vectorized, the default when numpy is installed
+    array       pure python on array("i") buses, the default otherwise
+    reference   one sample at a time, written to be obviously correct rather than fast.
+                Used to check the other backends, see compare_backends.
+"""
+import os
+import struct
+from abc import ABC, abstractmethod
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    ## numpy is optional, the engine falls back to the array backend.
+    np = None
+
+FRAMERATE = 44100
+SAMPLE_LENGTH = 2 * FRAMERATE
+BLOCK_FRAMES = 4096
+
+
+class MixBackend(ABC):
+    """
+    A bus is the integer sum of stems at unit gain. output() applies the 1 / divisor gain, then either
+    scales down to the peak (a whole mix) or clamps (a streamed block, where the peak is unknown).
+    """
+
+    name = ""
+
+    @abstractmethod
+    def new_bus(self, length: int):
+        """ :returns a silent bus of `length` frames: """
+
+    @abstractmethod
+    def accumulate(self, bus, frames, sign: int):
+        """
+        Adds (sign 1) or subtracts (sign -1) a stem. Stems shorter than the bus only touch its start,
+        longer ones are cut to the bus.
+        """
+
+    @abstractmethod
+    def output(self, bus, divisor: int, clamp: bool = False) -> bytes:
+        """ :returns packed 16bit frames: """
+
+
+class NumpyBackend(MixBackend):
+    name = "numpy"
+
+    def new_bus(self, length: int):
+        return np.zeros(length, dtype=np.int32)
+
+    def accumulate(self, bus, frames, sign: int):
+        samples = np.frombuffer(frames, dtype="<i2", count=min(len(frames) // 2, len(bus)))
+        if sign > 0:
+            bus[:len(samples)] += samples
+        else:
+            bus[:len(samples)] -= samples
+
+    def output(self, bus, divisor: int, clamp: bool = False) -> bytes:
+        amplitudes = bus.astype(np.float32) / divisor
+
+        if clamp:
+            np.clip(amplitudes, -32768, 32767, out=amplitudes)
+        else:
+            max_val = float(np.abs(amplitudes).max()) if len(amplitudes) else 0
+            if max_val > 32767:
+                amplitudes *= 32767 / max_val
+
+        return amplitudes.astype("<i2").tobytes()
+
+
+class ArrayBackend(MixBackend):
+    name = "array"
+
+    def new_bus(self, length: int):
+        return array("i", bytes(4 * length))
+
+    def accumulate(self, bus, frames, sign: int):
+        count = min(len(frames) // 2, len(bus))
+        samples = struct.unpack("<" + "h" * count, frames[:2 * count])
+        if sign > 0:
+            bus[:count] = array("i", [pair[0] + pair[1] for pair in zip(bus, samples)])
+        else:
+            bus[:count] = array("i", [pair[0] - pair[1] for pair in zip(bus, samples)])
+
+    def output(self, bus, divisor: int, clamp: bool = False) -> bytes:
+        amplitudes = [sample / divisor for sample in bus]
+
+        if clamp:
+            amplitudes = [max(-32768, min(32767, sample)) for sample in amplitudes]
+        else:
+            max_val = max((abs(sample) for sample in amplitudes), default=0)
+            if max_val > 32767:
+                amplitudes = [sample * 32767 / max_val for sample in amplitudes]
+
+        return struct.pack("<" + "h" * len(bus), *(int(sample) for sample in amplitudes))
+
+
+class ReferenceBackend(MixBackend):
+    name = "reference"
+
+    def new_bus(self, length: int):
+        return [0] * length
+
+    def accumulate(self, bus, frames, sign: int):
+        for i in range(min(len(frames) // 2, len(bus))):
+            bus[i] += sign * struct.unpack_from("<h", frames, 2 * i)[0]
+
+    def output(self, bus, divisor: int, clamp: bool = False) -> bytes:
+        peak = max((abs(sample) / divisor for sample in bus), default=0)
+
+        packed_frames = []
+        for sample in bus:
+            amplitude = sample / divisor
+            if clamp:
+                amplitude = max(-32768, min(32767, amplitude))
+            elif peak > 32767:
+                amplitude = amplitude * 32767 / peak
+            packed_frames.append(struct.pack("<h", int(amplitude)))
+
+        return b"".join(packed_frames)
+
+
+BACKENDS: dict[str, MixBackend] = {}
+
+
+def register_backend(backend: MixBackend):
+    BACKENDS[backend.name] = backend
+
+
+register_backend(ArrayBackend())
+register_backend(ReferenceBackend())
+if np is not None:
+    register_backend(NumpyBackend())
+
+_default = os.environ.get("FEST_RENDER_BACKEND") or ("numpy" if np is not None else "array")
+
+
+def available_backends() -> list[str]:
+    return list(BACKENDS)
+
+
+def get_backend(name: str | None = None) -> MixBackend:
+    """ :param name: backend name, defaults to the selected backend: """
+    name = name or _default
+    if name not in BACKENDS:
+        raise ValueError(f"unknown render backend {name!r}, available: {', '.join(BACKENDS)}")
+    return BACKENDS[name]
+
+
+def set_backend(name: str):
+    """ Selects the backend used by buses created from now on. """
+    global _default
+    get_backend(name)
+    _default = name
+
+
+def compare_backends(stems: list, divisor: int, first: str, second: str = "reference",
+                     length: int = SAMPLE_LENGTH) -> int:
+    """
+    A/B check of two backends on identical stems.
+
+    :returns the largest difference between their outputs, in 16bit steps. Backends that round
+        in float32 may differ from the reference by 1:
+    """
+    outputs = []
+    for name in (first, second):
+        bus = MixBus(length, name)
+        for i, frames in enumerate(stems):
+            bus.add(str(i), str(i), frames)
+        output = bus.render(divisor)
+        outputs.append(struct.unpack("<" + "h" * length, output))
+
+    return max((abs(a - b) for a, b in zip(*outputs)), default=0)
+
+
+class MixBus:
+    """
+    Persistent mix bus. Remembers which stems (by child id and content key) are currently mixed in,
+    so that a new FestMessage only costs the stems that were added, removed or changed.
+
+    Mixing / re-normalization policy:
+    The bus holds the exact integer sum of every stem at unit gain. Every stem shares the same gain,
+    1 / divisor (the message length), which is only applied when the output is produced. A change
+    in the number of children therefore never requires re-summing the stems: render() divides the
+    bus by the new divisor and, if the result still clips, scales it down to the peak. Because the
+    sum is kept in integers, adding and subtracting stems never accumulates rounding drift.
+    """
+
+    def __init__(self, length: int = SAMPLE_LENGTH, backend: str | None = None):
+        self.length = length
+        self.backend = get_backend(backend)
+        self.__stems: dict[str, tuple[str, object]] = {}
+        self.__bus = None
+        self.reset()
+
+    def reset(self):
+        self.__stems = {}
+        self.__bus = self.backend.new_bus(self.length)
+
+    def __contains__(self, stem_id: str) -> bool:
+        return stem_id in self.__stems
+
+    def __len__(self) -> int:
+        return len(self.__stems)
+
+    def stem_ids(self) -> set[str]:
+        return set(self.__stems)
+
+    def key_of(self, stem_id: str) -> str | None:
+        """ :returns the content key the stem was mixed in with, None if it is not on the bus: """
+        entry = self.__stems.get(stem_id)
+        return entry[0] if entry is not None else None
+
+    def add(self, stem_id: str, key: str, frames):
+        """
+        Mixes a stem in. If the id is already on the bus its previous frames are swapped out first.
+
+        :param stem_id: child id (the tile id):
+        :param key: content key, see stem_key:
+        :param frames: raw 16bit mono frames, kept so the stem can be subtracted later:
+        """
+        self.remove(stem_id)
+        self.backend.accumulate(self.__bus, frames, 1)
+        self.__stems[stem_id] = (key, frames)
+
+    def remove(self, stem_id: str):
+        entry = self.__stems.pop(stem_id, None)
+        if entry is not None:
+            self.backend.accumulate(self.__bus, entry[1], -1)
+
+    def render(self, divisor: int) -> bytes:
+        """
+        Applies the mixing policy to the bus.
+
+        :param divisor: mixing divisor (the message length):
+        :returns packed 16bit output frames:
+        """
+        return self.backend.output(self.__bus, max(divisor, 1))
+
+
+def iter_mix_blocks(stems: list, divisor: int, length: int = SAMPLE_LENGTH, block_frames: int = BLOCK_FRAMES,
+                    backend: str | None = None):
+    """
+    Streaming mixer. Pulls fixed-size blocks from every stem and yields the packed output block by block,
+    so memory stays constant whatever the output length. Stems are bars: each one repeats every
+    SAMPLE_LENGTH frames and is padded with silence up to the bar. Blocks never straddle a bar line.
+
+    Streaming cannot look ahead for the peak, so instead of scaling to the peak the output is clamped.
+    With the 1 / divisor gain an average of 16 bit stems can only reach -32768, so this matches
+    MixBus.render for every real mix.
+
+    :param stems: raw 16bit mono frames of at most one bar each:
+    :param divisor: mixing divisor (the message length):
+    :param length: total output length in frames:
+    :param block_frames: frames per yielded block:
+    :param backend: backend name, defaults to the selected backend:
+    """
+    mixer = get_backend(backend)
+    divisor = max(divisor, 1)
+    position = 0
+    while position < length:
+        offset = position % SAMPLE_LENGTH
+        count = min(block_frames, SAMPLE_LENGTH - offset, length - position)
+
+        block = mixer.new_bus(count)
+        for frames in stems:
+            mixer.accumulate(block, memoryview(frames)[2 * offset:2 * (offset + count)], 1)
+        yield mixer.output(block, divisor, clamp=True)
+
+        position += count
@@ -0,0 +1,143 @@
+import time
+import threading
+import traceback
+from enum import Enum
+from typing import Callable
+
+from .metrics import METRICS
+
+## Background sound rendering, so the client's game loop never blocks on mixing.
+
+RENDER_TIMEOUT = 5.0
+
+
+class SCStatus(Enum):
+    IDLE = 0
+    IN_PROGRESS = 1
+    COMPLETE = 2
+
+
+class RenderCancelled(Exception):
+    """ Raised at a checkpoint when a newer state superseded the render. """
+
+
+class RenderTimeout(Warning):
+    """ Raised at a checkpoint when the render took longer than its timeout. """
+
+
+class RenderWorker:
+    """
+    Renders FestMessage payloads on a background thread.
+
+    Bursts are coalesced: only the newest submitted payload is kept, older pending ones are dropped.
+    A render that is in flight when a newer payload arrives is cancelled at its next checkpoint
+    (a block or stem boundary). Every render gets `timeout` seconds.
+
+    The render function is called as render(message, checkpoint), and must call checkpoint()
+    regularly; checkpoint raises RenderCancelled or RenderTimeout.
+    """
+
+    def __init__(self, render: Callable[[dict, Callable[[], None]], None], timeout: float = RENDER_TIMEOUT,
+                 on_complete: Callable[[dict], None] | None = None, print_tracebacks: bool = True):
+        """
+        :param print_tracebacks: print the full traceback of a failed render, otherwise only its error:
+        """
+        self.timeout = timeout
+        self.on_complete = on_complete
+        self.print_tracebacks = print_tracebacks
+        self.status = SCStatus.IDLE
+        self.last_error: Exception | None = None
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.timed_out = 0
+
+        self.__render = render
+        self.__condition = threading.Condition()
+        self.__pending: dict | None = None
+        self.__generation = 0
+        self.__thread: threading.Thread | None = None
+        self.__stopped = False
+
+    def submit(self, message: dict):
+        """ Queues a payload for rendering and returns immediately. """
+        with self.__condition:
+            if self.__pending is not None:
+                self.coalesced += 1
+            self.__pending = message
+            self.__generation += 1
+            self.status = SCStatus.IN_PROGRESS
+            self.__stopped = False
+
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, name="fest-render", daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def __checkpoint(self, generation: int, deadline: float) -> Callable[[], None]:
+        def checkpoint():
+            if self.__generation != generation or self.__stopped:
+                raise RenderCancelled()
+            if time.monotonic() > deadline:
+                raise RenderTimeout("Sound Render Timeout")
+        return checkpoint
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while self.__pending is None and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                message, generation = self.__pending, self.__generation
+                self.__pending = None
+
+            succeeded = False
+            try:
+                self.__render(message, self.__checkpoint(generation, time.monotonic() + self.timeout))
+                succeeded = True
+            except RenderCancelled:
+                self.superseded += 1
+            except RenderTimeout as error:
+                self.timed_out += 1
+                self.last_error = error
+            except Exception as error:
+                self.failed += 1
+                self.last_error = error
+                if METRICS.enabled:
+                    METRICS.inc("render.failed")
+                if self.print_tracebacks:
+                    traceback.print_exc()
+                else:
+                    print("Render failed:", error)
+
+            if succeeded:
+                self.completed += 1
+                if self.on_complete is not None:
+                    self.on_complete(message)
+
+            with self.__condition:
+                if self.__pending is None:
+                    self.status = SCStatus.COMPLETE if succeeded else SCStatus.IDLE
+                    self.__condition.notify_all()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Blocks until nothing is pending or rendering. Meant for tests and shutdown, never the game loop.
+
+        :returns False if the timeout expired first:
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.status != SCStatus.IN_PROGRESS, timeout)
+
+    def stop(self):
+        """ Cancels the in-flight render and ends the thread. """
+        with self.__condition:
+            self.__stopped = True
+            self.__pending = None
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+        self.status = SCStatus.IDLE
@@ -0,0 +1,22 @@
+## Fest sound assets, in tile order. Kept free of server imports so the client renderer
+## and the offline sound bank tool can use the same table.
+
+SOUND_FILEPATHS = [
+    "sound/fest/i1.wav", "sound/fest/i2.wav", "sound/fest/i3.wav", "sound/fest/i4.wav",
+    "sound/fest/arp1.wav",
+    "sound/fest/yeah.wav",
+    "sound/fest/awful.wav",
+    "sound/fest/clarinet.wav",
+    "sound/fest/replacement.wav",
+    "sound/fest/bass.wav",
+    "sound/fest/guitar1.wav",
+    "sound/fest/guitar2.wav",
+    "sound/fest/drum1.wav",
+    "sound/fest/drums2.wav",
+    "sound/fest/drums3.wav",
+    "sound/fest/drums4s.wav",
+    "sound/fest/backing_track.wav"
+]
+
+## instrument samples: an 8 note scale instead of a single bar loop
+INSTRUMENT_FILEPATHS = SOUND_FILEPATHS[:4]
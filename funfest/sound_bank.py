@@ -0,0 +1,207 @@
+"""
+Offline normalizer and packer for the fest sound assets.
+
+Every asset of SOUND_FILEPATHS is checked and normalized to 16bit mono 44.1 kHz: loops are padded or
+trimmed to exactly one bar (SAMPLE_LENGTH frames), instrument samples to their full 8 note scale.
+The results are packed into a single memory-mappable sound bank, so the renderer opens one file at startup.
+
+Run from the folder that contains this package:
+    python -m <package>.funfest.sound_bank --root <package>/resources [--rewrite] [--check]
+
+Bank layout (little endian):
+    8 bytes   magic, b"FESTBNK1"
+    4 bytes   length of the JSON index
+    n bytes   JSON index: format fields and {"assets": {path: [offset, nframes]}}
+    data      16bit frames of every asset, each starting on a 16 byte boundary
+"""
+import os
+import sys
+import json
+import mmap
+import wave
+import struct
+import argparse
+from array import array
+
+from .pcm_cache import PCMAsset
+from .note_index import NOTE_COUNT, NOTE_LENGTH
+from .sound_assets import SOUND_FILEPATHS, INSTRUMENT_FILEPATHS
+
+FRAMERATE = 44100
+SAMPLE_LENGTH = 2 * FRAMERATE
+
+BANK_MAGIC = b"FESTBNK1"
+BANK_FILEPATH = "sound/fest/fest.bank"
+ALIGNMENT = 16
+
+
+def expected_length(path: str) -> int:
+    """ :returns the length in frames an asset must have: """
+    return NOTE_COUNT * NOTE_LENGTH if path in INSTRUMENT_FILEPATHS else SAMPLE_LENGTH
+
+
+def normalize(path: str, length: int) -> tuple[bytes, list[str]]:
+    """
+    Converts a wav file to 16bit mono frames of exactly `length` frames.
+
+    :param path: wav file:
+    :param length: frames to pad or trim to:
+    :returns (frames, list of the fixes that were needed). Raises ValueError for what cannot be fixed:
+    """
+    fixes = []
+    with wave.open(path, "rb") as sample:
+        nchannels = sample.getnchannels()
+        sampwidth = sample.getsampwidth()
+        framerate = sample.getframerate()
+        frames = sample.readframes(sample.getnframes())
+
+    if sampwidth != 2:
+        raise ValueError(f"{path}: {8 * sampwidth}bit samples are not supported, export as 16bit")
+    if framerate != FRAMERATE:
+        raise ValueError(f"{path}: {framerate} Hz, resample to {FRAMERATE} Hz")
+
+    samples = array("h")
+    samples.frombytes(frames)
+    if sys.byteorder == "big":
+        samples.byteswap()
+
+    if nchannels != 1:
+        fixes.append(f"mixed {nchannels} channels down to mono")
+        samples = array("h", (sum(samples[i:i + nchannels]) // nchannels for i in range(0, len(samples), nchannels)))
+
+    if len(samples) < length:
+        fixes.append(f"padded {length - len(samples)} frames")
+        samples.extend([0] * (length - len(samples)))
+    elif len(samples) > length:
+        fixes.append(f"trimmed {len(samples) - length} frames")
+        del samples[length:]
+
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes(), fixes
+
+
+def write_wav(path: str, frames: bytes):
+    with wave.open(path, "wb") as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(FRAMERATE)
+        output.writeframes(frames)
+
+
+def build_bank(root: str, output: str | None = None, paths: list[str] = SOUND_FILEPATHS,
+               rewrite: bool = False) -> dict[str, list[str]]:
+    """
+    Normalizes every asset and packs them into a sound bank.
+
+    :param root: folder the asset paths are relative to (resources/ on the server, rsrc_cache/ on a client):
+    :param output: bank file, defaults to <root>/sound/fest/fest.bank:
+    :param paths: assets to pack:
+    :param rewrite: also write the normalized wav files back in place:
+    :returns the fixes applied, per asset:
+    """
+    output = output or os.path.join(root, BANK_FILEPATH)
+    fixes = {}
+    assets = {}
+    for path in paths:
+        frames, fixes[path] = normalize(os.path.join(root, path), expected_length(path))
+        assets[path] = frames
+        if rewrite and fixes[path]:
+            write_wav(os.path.join(root, path), frames)
+
+    ## offsets depend on the index length, which depends on the offsets: settle on a fixed point
+    index = {"framerate": FRAMERATE, "sampwidth": 2, "nchannels": 1, "assets": {}}
+    data_start = 0
+    while True:
+        offset = data_start
+        for path, frames in assets.items():
+            index["assets"][path] = [offset, len(frames) // 2]
+            offset += len(frames) + (-len(frames) % ALIGNMENT)
+        header = json.dumps(index, sort_keys=True).encode()
+        aligned = len(BANK_MAGIC) + 4 + len(header)
+        aligned += -aligned % ALIGNMENT
+        if aligned == data_start:
+            break
+        data_start = aligned
+
+    temp = output + ".tmp"
+    with open(temp, "wb") as file:
+        file.write(BANK_MAGIC)
+        file.write(struct.pack("<I", len(header)))
+        file.write(header)
+        for path, frames in assets.items():
+            file.seek(index["assets"][path][0])
+            file.write(frames)
+    os.replace(temp, output)
+
+    return fixes
+
+
+class SoundBank:
+    """ Read-only, memory-mapped view of a sound bank. """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            self.__mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        ## (mtime_ns, size) of the mapped file, a rebuilt bank has a different one
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+
+        if self.__mapping[:len(BANK_MAGIC)] != BANK_MAGIC:
+            raise ValueError(f"{path} is not a fest sound bank")
+        header_length = struct.unpack_from("<I", self.__mapping, len(BANK_MAGIC))[0]
+        start = len(BANK_MAGIC) + 4
+        index = json.loads(bytes(self.__mapping[start:start + header_length]))
+
+        self.framerate = index["framerate"]
+        self.__index: dict[str, list[int]] = index["assets"]
+        self.__assets: dict[str, PCMAsset] = {}
+
+        view = memoryview(self.__mapping)
+        for asset_path, (offset, nframes) in self.__index.items():
+            if offset + 2 * nframes > len(self.__mapping):
+                raise ValueError(f"{path}: {asset_path} runs past the end of the bank")
+            self.__assets[asset_path] = PCMAsset(asset_path, 1, 2, self.framerate,
+                                                 view[offset:offset + 2 * nframes].toreadonly(), True)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.__assets
+
+    def __iter__(self):
+        return iter(self.__assets)
+
+    def get(self, path: str) -> PCMAsset | None:
+        """ :param path: asset path, as in SOUND_FILEPATHS: """
+        return self.__assets.get(path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Validate, normalize and pack the fest sound assets.")
+    parser.add_argument("--root", default="resources", help="folder the sound paths are relative to")
+    parser.add_argument("--output", default=None, help="bank file, defaults to <root>/" + BANK_FILEPATH)
+    parser.add_argument("--rewrite", action="store_true", help="also rewrite the normalized wav files")
+    parser.add_argument("--check", action="store_true", help="only report, fail if an asset needs fixing")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failed = False
+        for path in SOUND_FILEPATHS:
+            try:
+                _, fixes = normalize(os.path.join(args.root, path), expected_length(path))
+            except (ValueError, OSError, wave.Error) as error:
+                fixes = [str(error)]
+            if fixes:
+                failed = True
+                print(path + ": " + "; ".join(fixes))
+        return 1 if failed else 0
+
+    for path, fixes in build_bank(args.root, args.output, rewrite=args.rewrite).items():
+        if fixes:
+            print(path + ": " + "; ".join(fixes))
+    print("Wrote", args.output or os.path.join(args.root, BANK_FILEPATH))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Callable
+
+## Memoizes rendered instrument stems, so an instrument tile whose sequence did not change
+## costs nothing when another tile toggles. Stems live in memory first and on disk second.
+
+STEM_DIRECTORY = "rsrc_cache/sound/fest/stems"
+DEFAULT_MEMORY_BUDGET = 16 * 1024 * 1024
+DEFAULT_DISK_BUDGET = 64 * 1024 * 1024
+
+
+def stem_key(source_path: str, sequence: str, framerate: int, signature: str | None = None) -> str:
+    """
+    Content address of a rendered stem. The source's mtime and size are part of the key
+    so that replacing a sample never serves a stale stem.
+
+    :param signature: what the source was read from, see PCMCache.source_signature. Defaults to the source file's
+        mtime and size, which does not change when a rebuilt sound bank serves the asset:
+    :returns hex digest:
+    """
+    if signature is None:
+        try:
+            stat = os.stat(source_path)
+            signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+        except OSError:
+            signature = "missing"
+
+    return hashlib.sha1(f"{source_path}\0{signature}\0{sequence}\0{framerate}".encode()).hexdigest()
+
+
+class StemCache:
+    """
+    Two level LRU cache of raw stem frames. Both levels have their own byte cap,
+    the disk level evicts the least recently used files of its directory.
+    """
+
+    def __init__(self, directory: str = STEM_DIRECTORY, max_memory_bytes: int = DEFAULT_MEMORY_BUDGET,
+                 max_disk_bytes: int = DEFAULT_DISK_BUDGET):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.__memory: OrderedDict[str, bytes] = OrderedDict()
+        self.__memory_bytes = 0
+        self.__disk: OrderedDict[str, int] | None = None
+        self.__disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """
+        :param key: see stem_key:
+        :param render: called on a miss, must return the raw frames of the stem:
+        :returns the frames of the stem:
+        """
+        frames = self.__memory.get(key)
+        if frames is not None:
+            self.hits += 1
+            self.__memory.move_to_end(key)
+            return frames
+
+        frames = self.__read_disk(key)
+        if frames is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            frames = bytes(render())
+            self.__write_disk(key, frames)
+
+        self.__store_memory(key, frames)
+        return frames
+
+    def __contains__(self, key: str) -> bool:
+        """ Whether the stem is cached, in memory or on disk. """
+        return key in self.__memory or key in self.__disk_index()
+
+    def __store_memory(self, key: str, frames: bytes):
+        self.__memory[key] = frames
+        self.__memory_bytes += len(frames)
+        while self.__memory_bytes > self.max_memory_bytes and len(self.__memory) > 1:
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_bytes -= len(evicted)
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pcm")
+
+    def __disk_index(self) -> OrderedDict[str, int]:
+        """ Lazily scans the stem directory, oldest files first. """
+        if self.__disk is None:
+            self.__disk = OrderedDict()
+            self.__disk_bytes = 0
+            if os.path.isdir(self.directory):
+                entries = []
+                for name in os.listdir(self.directory):
+                    if name.endswith(".pcm"):
+                        stat = os.stat(os.path.join(self.directory, name))
+                        entries.append((stat.st_mtime_ns, name[:-4], stat.st_size))
+                for _, key, size in sorted(entries):
+                    self.__disk[key] = size
+                    self.__disk_bytes += size
+        return self.__disk
+
+    def __read_disk(self, key: str) -> bytes | None:
+        index = self.__disk_index()
+        if key not in index:
+            return None
+        try:
+            with open(self.__path(key), "rb") as file:
+                frames = file.read()
+            os.utime(self.__path(key))
+        except OSError:
+            self.__disk_bytes -= index.pop(key)
+            return None
+
+        index.move_to_end(key)
+        return frames
+
+    def __write_disk(self, key: str, frames: bytes):
+        if self.max_disk_bytes <= 0:
+            return
+        index = self.__disk_index()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp = self.__path(key) + ".tmp"
+            with open(temp, "wb") as file:
+                file.write(frames)
+            os.replace(temp, self.__path(key))
+        except OSError:
+            ## the disk level is only an optimization
+            return
+
+        index[key] = len(frames)
+        self.__disk_bytes += len(frames)
+        while self.__disk_bytes > self.max_disk_bytes and len(index) > 1:
+            evicted, size = index.popitem(last=False)
+            self.__disk_bytes -= size
+            try:
+                os.remove(self.__path(evicted))
+            except OSError:
+                pass
+
+    def clear_memory(self):
+        self.__memory.clear()
+        self.__memory_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "memory_bytes": self.__memory_bytes, "disk_bytes": self.__disk_bytes}
+
+
+## shared by every render in the process
+STEM_CACHE = StemCache()
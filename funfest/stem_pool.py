@@ -0,0 +1,77 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+## Fans instrument stem rendering out to worker processes. Small jams stay serial,
+## since starting and feeding the pool costs more than rendering one or two stems.
+
+PARALLEL_THRESHOLD = 2
+## the client runs the game next to the renderer, so the pool only takes a couple of cores
+DEFAULT_WORKERS = 2
+
+
+def _start_context():
+    """
+    Workers are never forked from the client: it runs the render worker and the game's threads,
+    and a fork copies whatever locks those hold. forkserver where the platform has it, spawn elsewhere.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class StemPool:
+    """
+    Runs one job per stem, in worker processes when there are enough of them.
+    Results come back as they complete, so the caller can mix while the rest still render.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, threshold: int = PARALLEL_THRESHOLD):
+        """
+        :param workers: worker processes. 1 disables the pool:
+        :param threshold: fewest jobs worth sending to the pool:
+        """
+        self.workers = workers
+        self.threshold = threshold
+        self.__executor: ProcessPoolExecutor | None = None
+
+    def configure(self, workers: int | None = None, threshold: int | None = None):
+        """ Changes the worker count or threshold. A running pool is restarted with the new size. """
+        if workers is not None and workers != self.workers:
+            self.shutdown()
+            self.workers = workers
+        if threshold is not None:
+            self.threshold = threshold
+
+    def run(self, job: Callable, arguments: dict) -> Iterator[tuple[object, Future]]:
+        """
+        :param job: picklable, module level function:
+        :param arguments: stem id -> the single argument of its job:
+        :returns (stem id, finished future) pairs, in completion order. future.result() re-raises job errors:
+        """
+        if self.workers <= 1 or len(arguments) < max(self.threshold, 2):
+            for stem_id, argument in arguments.items():
+                future = Future()
+                try:
+                    future.set_result(job(argument))
+                except Exception as error:
+                    future.set_exception(error)
+                yield stem_id, future
+            return
+
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_start_context())
+
+        futures = {self.__executor.submit(job, argument): stem_id for stem_id, argument in arguments.items()}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future
+        finally:
+            ## a cancelled render drops the stems that have not started yet
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = None
@@ -1,53 +1,41 @@
 from ..imports import *
+import weakref
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from Player import Player
 
-SOUND_FILEPATHS = [
-    "sound/fest/i1.wav", "sound/fest/i2.wav", "sound/fest/i3.wav", "sound/fest/i4.wav",
-    "sound/fest/arp1.wav",
-    "sound/fest/yeah.wav",
-    "sound/fest/awful.wav",
-    "sound/fest/clarinet.wav",
-    "sound/fest/replacement.wav",
-    "sound/fest/bass.wav",
-    "sound/fest/guitar1.wav",
-    "sound/fest/guitar2.wav",
-    "sound/fest/drum1.wav",
-    "sound/fest/drums2.wav",
-    "sound/fest/drums3.wav",
-    "sound/fest/drums4s.wav",
-    "sound/fest/backing_track.wav"
-]
+from .sound_assets import SOUND_FILEPATHS, INSTRUMENT_FILEPATHS
+from .metrics import METRICS
 
 class FlyweightTile:
-    """ Flyweight class representing an abstract tile defined by coordinate boundaries. """
-    _instances = {}  # Dictionary to store shared FlyweightTile instances
+    """
+    Flyweight class representing an abstract tile defined by coordinate boundaries.
+    Only the immutable geometry and sound assignment live here, so one instance can be shared by every room.
+    Per-room state, like an instrument tile's sequence, is kept by the room's TileMap.
+    """
+    __slots__ = ("tile_id", "top_left", "bottom_right", "sound_path", "is_number_sequence_tile", "__weakref__")
+    ## shared instances, dropped once no TileMap uses them anymore
+    _instances: "weakref.WeakValueDictionary[tuple, FlyweightTile]" = weakref.WeakValueDictionary()
 
 
     def __new__(cls, tile_id: int, top_left: tuple[int, int], bottom_right: tuple[int, int],sound_path: str=None,is_number_sequence_tile: bool = False):
         """ Create or return an existing FlyweightTile instance. """
-        # Use the tile_id and coordinates as the key
-        key = (tile_id, top_left, bottom_right)
+        # Every intrinsic field is part of the key, tiles that differ in any of them are different flyweights
+        key = (tile_id, top_left, bottom_right, sound_path, is_number_sequence_tile)
 
-        # Check if the FlyweightTile already exists
-        if key not in cls._instances:
-            # Create a new FlyweightTile instance
+        instance = cls._instances.get(key)
+        if instance is None:
             instance = super().__new__(cls)
-            instance.tile_id = tile_id
-            instance.top_left = top_left
-            instance.bottom_right = bottom_right
-            instance.sound_path = sound_path
-            instance.is_number_sequence_tile = is_number_sequence_tile
-            instance.stored_sequence = [] if is_number_sequence_tile else None
-            cls._instances[key] = instance  # Store the instance
-        else:
-            # Return the existing instance
-            instance = cls._instances[key]
+            for name, value in zip(cls.__slots__, key):
+                object.__setattr__(instance, name, value)
+            cls._instances[key] = instance
 
         return instance
 
+    def __setattr__(self, name, value):
+        raise AttributeError("FlyweightTile is shared between rooms and cannot be changed, see TileMap for room state")
+
 
     def get_sound_filepath(self) -> str | None:
         """ Return the sound filepath for this tile. """
@@ -58,74 +46,95 @@ class FlyweightTile:
         return self.tile_id
 
 
-    def store_number(self, number: int):
-        """ Store a number in the tile's sequence if it's a number-sequence tile. """
-        if self.is_number_sequence_tile:
-            self.stored_sequence.append(number)  # Store the number for later use
-
-
-    def get_stored_sequence(self):
-        """ Get the stored sequence (only for number-sequence tiles). """
-        return self.stored_sequence if self.is_number_sequence_tile else None
-
-    def clear_stored_sequence(self):
-        """" Emptys the sequence"""
-        if self.is_number_sequence_tile:
-            self.stored_sequence = []
-        else: raise Warning("Tile is not a number sequence.")
 
+## one sound per tile, in tile id order; the backing track is not on a tile
+TILE_SOUND_FILEPATHS = SOUND_FILEPATHS[:16]
 
 
 class TileMap:
-    """ A Flyweight tile system where tiles exist only as coordinate ranges. """
-    def __init__(self, start_y: int, start_x: int, tile_size: int = 4):
+    """
+    A Flyweight tile system where tiles exist only as coordinate ranges.
+    Tiles form a rows x cols grid of square tiles starting at (start_y, start_x), so the tile under a
+    position is found arithmetically, in constant time however large the stage is.
+    """
+    def __init__(self, start_y: int, start_x: int, tile_size: int = 4, rows: int = 4, cols: int = 4,
+                 sound_paths: list[str] = TILE_SOUND_FILEPATHS):
+        """
+        :param sound_paths: assigned to the tiles in id order, repeating when there are more tiles than sounds.
+            Tiles with an instrument sample are number-sequence tiles. Must be in SOUND_FILEPATHS, the path table
+            fest messages refer to:
+        """
+        unknown = [path for path in sound_paths if path not in SOUND_FILEPATHS]
+        if unknown or not sound_paths:
+            raise ValueError(f"Tile sounds must be non-empty and in SOUND_FILEPATHS, unknown: {unknown}")
         self.tiles: dict[tuple[tuple[int, int], tuple[int, int]], FlyweightTile] = {}  # Store FlyweightTile instances
         self.tile_size = tile_size
-        self.generate_tiles(start_y, start_x)
+        self.rows = rows
+        self.cols = cols
+        self.origin = (start_y, start_x)
+        ## tiles in row major order, index row * cols + col
+        self.grid: list[FlyweightTile] = []
+        self.generate_tiles(start_y, start_x, sound_paths)
         self.current_tile_for_player: dict[str, FlyweightTile | None] = {}
+        ## sequences entered on this room's instrument tiles, by tile id
+        self.sequences: dict[int, list[int]] = {}
+        ## last position looked up per player, tiles are only matched again once it changes
+        self.player_positions: dict[str, tuple[int, int]] = {}
         self.observers = []
     def add_observer(self, callback):
         self.observers.append(callback)
 
 
 
-    def generate_tiles(self, start_y: int, start_x: int):
-        """ Generates a 4x4 grid of abstract tiles and assigns a unique ID (1-16) to each tile. """
-        tile_id = 1  # Unique ID for each 4x4 tile
+    def generate_tiles(self, start_y: int, start_x: int, sound_paths: list[str] = TILE_SOUND_FILEPATHS):
+        """ Generates the rows x cols grid of abstract tiles and assigns a unique ID (1 to rows * cols) to each tile. """
+        tile_id = 1  # Unique ID for each tile
 
-        for row in range(4):
-            for col in range(4):
+        for row in range(self.rows):
+            for col in range(self.cols):
                 top_left = (start_y + row * self.tile_size, start_x + col * self.tile_size)
                 bottom_right = (top_left[0] + self.tile_size - 1, top_left[1] + self.tile_size - 1)
-                sound_path = SOUND_FILEPATHS[tile_id - 1]
+                sound_path = sound_paths[(tile_id - 1) % len(sound_paths)]
 
                 # Create or retrieve a FlyweightTile instance using the Flyweight pattern
-                is_number_sequence_tile = tile_id in {1, 2, 3, 4}
+                is_number_sequence_tile = sound_path in INSTRUMENT_FILEPATHS
                 flyweight_tile = FlyweightTile(tile_id, top_left, bottom_right,sound_path,is_number_sequence_tile)
                 self.tiles[(top_left, bottom_right)] = flyweight_tile  # Store the FlyweightTile instance
+                self.grid.append(flyweight_tile)
 
                 tile_id += 1
 
+    def tile_at(self, y: int, x: int) -> FlyweightTile | None:
+        """ :returns the tile covering (y, x), None outside the grid: """
+        row = (y - self.origin[0]) // self.tile_size
+        col = (x - self.origin[1]) // self.tile_size
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self.grid[row * self.cols + col]
+        return None
+
 
     def check_player_position(self, player: Player) -> tuple[int | None, FlyweightTile | None, str | None]:
+        """
+        Matches the player's position to a tile and notifies the observer when the player left or entered one.
+        Call it when the player moved; a position that did not change is answered from the cache.
+        """
         player_position = player.get_current_position()
         player_pos_tuple = (player_position.y, player_position.x)
+        if self.player_positions.get(player.get_name()) == player_pos_tuple:
+            return self.get_player_tile(player)
+        self.player_positions[player.get_name()] = player_pos_tuple
 
 
-        matched_tile = None
-        for (top_left, bottom_right), flyweight_tile in self.tiles.items():
-            if (top_left[0] <= player_pos_tuple[0] <= bottom_right[0] and
-                    top_left[1] <= player_pos_tuple[1] <= bottom_right[1]):
-                matched_tile = flyweight_tile
-                break
+        matched_tile = self.tile_at(*player_pos_tuple)
 
 
         old_tile = self.current_tile_for_player.get(player.get_name(), None)
-
+        if METRICS.enabled and old_tile != matched_tile:
+            METRICS.inc("tiles.transitions")
 
         if old_tile is not None and old_tile != matched_tile:
             if old_tile.is_number_sequence_tile:
-                old_tile.stored_sequence = []
+                self.clear_stored_sequence(old_tile)
 
 
             if len(self.observers) > 0:
@@ -140,11 +149,46 @@ class TileMap:
                 funfest_house.on_tile_activated(matched_tile)
         # Update the player’s current tile reference
         self.current_tile_for_player[player.get_name()] = matched_tile
-        if matched_tile:
-            return matched_tile.tile_id, matched_tile, matched_tile.sound_path
+        return self.get_player_tile(player)
+
+    def store_number(self, tile: FlyweightTile, number: int):
+        """ Store a number in the tile's sequence if it's a number-sequence tile. """
+        if tile.is_number_sequence_tile:
+            self.sequences.setdefault(tile.tile_id, []).append(number)
+
+    def get_stored_sequence(self, tile: FlyweightTile) -> list[int] | None:
+        """ Get the stored sequence (only for number-sequence tiles). """
+        return self.sequences.get(tile.tile_id, []) if tile.is_number_sequence_tile else None
+
+    def clear_stored_sequence(self, tile: FlyweightTile):
+        """" Emptys the sequence"""
+        if tile.is_number_sequence_tile:
+            self.sequences.pop(tile.tile_id, None)
+        else: raise Warning("Tile is not a number sequence.")
+
+    def get_player_tile(self, player: Player) -> tuple[int | None, FlyweightTile | None, str | None]:
+        """ The tile the player was on when their position was last checked, without looking at it again. """
+        if player.get_name() not in self.current_tile_for_player:
+            return self.check_player_position(player)
+
+        tile = self.current_tile_for_player[player.get_name()]
+        if tile:
+            return tile.tile_id, tile, tile.sound_path
         else:
             return None, None, None
 
+    def remove_player(self, player: Player):
+        """ Deactivates the tile the player was on and forgets them. """
+        old_tile = self.current_tile_for_player.pop(player.get_name(), None)
+        self.player_positions.pop(player.get_name(), None)
+
+        if old_tile is not None:
+            if old_tile.is_number_sequence_tile:
+                self.clear_stored_sequence(old_tile)
+            if len(self.observers) > 0:
+                self.observers[0].notify_tile_deactivation(old_tile, player)
+                self.observers[0].remove_tile_loop(old_tile, player)
+
 class Observer:
     def __init__(self,player):
         self.player_id= player.get_name()
@@ -1,7 +1,14 @@
+import os
+import time
+from functools import partial
 from .imports import *
 from .funfest.tileMap import TileMap, FlyweightTile, SOUND_FILEPATHS
-from .funfest.fest_message import FestMessage, InstrumentMessage, LoopMessage
+from .funfest.fest_message import FestMessage, InstrumentMessage, LoopMessage, KEYFRAME_INTERVAL
 from .funfest.instrument_command import ClearSequence, AddToSequence
+from .funfest.sound_bank import BANK_FILEPATH
+from .funfest.metrics import METRICS, COUNT_BOUNDS
+from .funfest.fest_scheduler import FestScheduler
+from .funfest.outbound import ClientOutbox
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -19,16 +26,39 @@ DIRECTORY = [
     "/fest/backing_track.wav"
 ]
 
+RESOURCES = os.path.join(os.path.dirname(__file__), "resources")
+
 
 # multiple of 2!!:
 roomWidth = 36
 roomHeight = 40
 
+## cobblestone floor as ((top, left), (bottom, right)) rectangles, inclusive: the entrance corridor and the stage
+FLOOR_REGIONS = [
+    ((roomWidth - 10, (roomWidth // 2) - 2), (roomHeight - 1, (roomWidth // 2) + 1)),
+    ((10, 10), (roomWidth - 11, roomWidth - 11)),
+]
+
+def is_floor(y: int, x: int) -> bool:
+    """ Whether the cell is walkable floor, inside one of FLOOR_REGIONS. """
+    return any(top <= y <= bottom and left <= x <= right for (top, left), (bottom, right) in FLOOR_REGIONS)
+
+def wall_ring() -> set[tuple[int, int]]:
+    """ :returns the (y, x) cells of the room that touch the floor, diagonals included, without being floor: """
+    ring = set()
+    for (top, left), (bottom, right) in FLOOR_REGIONS:
+        for y in range(top - 1, bottom + 2):
+            for x in range(left - 1, right + 2):
+                if 0 <= y < roomHeight and 0 <= x < roomWidth and not is_floor(y, x):
+                    ring.add((y, x))
+    return ring
+
 class FunFestHouse(Map):
 
     MAIN_ENTRANCE = True
 
-    clock_two = False
+    ## see static_layout
+    _static_layout: list[tuple[MapObject, Coord]] | None = None
 
     def __init__(self) -> None:
         super().__init__(
@@ -44,87 +74,197 @@ class FunFestHouse(Map):
         self.tile_map=TileMap(10,10,4)
         self.active_tiles = FestMessage(self)
         self.tile_map.add_observer(self)
-        self.player_load_queue = []
+        self.player_load_queue: set[Player] = set()
         self.observers = []
         self.sequence_store = [[],[],[],[]]
+        ## fingerprint of the last broadcast state, and the last version each player received
+        self.broadcast_fingerprint = None
+        self.acknowledged: dict[str, int] = {}
+        ## the mix is replayed once somebody joined
+        self.playing = False
+        ## broadcast, re-render and replay pacing, see scheduler.configure
+        self.scheduler = FestScheduler()
+        ## latest-wins outbound slots per player name
+        self.outboxes: dict[str, ClientOutbox] = {}
+        ## broadcast ticks so far, every KEYFRAME_INTERVAL-th sends everyone a snapshot
+        self.broadcasts = 0
 
     def on_tile_activated(self, tile):
         if tile.sound_path and tile.get_tile_id() >= 1:
 
             if tile.is_number_sequence_tile:
                 #messages.append(ServerMessage(player, "Enter a number (1-8) in chat."))
-                self.active_tiles.add(InstrumentMessage(tile.get_sound_filepath(), tile.get_tile_id(), "".join(str(item) for item in tile.get_stored_sequence()) ))
+                self.active_tiles.add(InstrumentMessage(tile.get_sound_filepath(), tile.get_tile_id(), "".join(str(item) for item in self.tile_map.get_stored_sequence(tile)) ))
             else:
                 self.active_tiles.add(LoopMessage(tile.get_sound_filepath(), tile.get_tile_id()))
 
     def on_sequence_update(self, tile):
-        self.active_tiles.add(InstrumentMessage(tile.get_sound_filepath(), tile.get_tile_id(), "".join(str(item) for item in tile.get_stored_sequence())))
+        self.active_tiles.add(InstrumentMessage(tile.get_sound_filepath(), tile.get_tile_id(), "".join(str(item) for item in self.tile_map.get_stored_sequence(tile))))
+
+    @classmethod
+    def static_layout(cls) -> list[tuple[MapObject, Coord]]:
+        """
+        Floor, wall, festgrid and foreground objects. They never change, so they are built once per class
+        and shared by every instance. Impassable black walls only ring the floor regions: players cannot get
+        past them, and background_tile_image already draws the rest of the room black.
+        """
+        if cls._static_layout is None:
+            layout: list[tuple[MapObject, Coord]] = []
+            floor = MapObject('tile/background/cobblestone', True, 0)
+            for (top, left), (bottom, right) in FLOOR_REGIONS:
+                for y in range(top, bottom + 1):
+                    for x in range(left, right + 1):
+                        layout.append((floor, Coord(y, x)))
+
+            wall = MapObject('tile/background/black', False, 0)
+            for y, x in sorted(wall_ring()):
+                layout.append((wall, Coord(y, x)))
+
+            layout.append((MapObject("message", False, 10), Coord(28, 23)))
+
+            for i in range(6):
+                for j in range(7):
+                    layout.append((MapObject(f"tile/background/festgrid/row-{i + 1}-column-{j + 1}", True, 1),
+                                   Coord((4 * i) + 2, (4 * j) + 2)))
+                    if i == 1:
+                        layout.append((MapObject(f"fest-foreground-{j+1}", True, 10), Coord(23, (4*j) + 3)))
+
+            cls._static_layout = layout
+        return cls._static_layout
 
     def get_objects(self) -> list[tuple[MapObject, Coord]]:
         objects: list[tuple[MapObject, Coord]] = []
         door = Door('int_entrance', linked_room="Trottier Town", is_main_entrance=True)
         objects.append((door, Coord(roomHeight - 1, (roomWidth // 2) - 1)))
-
-        background = MapObject('tile/background/black', False, 0)
-        floor = MapObject('tile/background/cobblestone', True, 0)
-        for x in range(roomWidth):
-            for y in range(roomHeight):
-                if (((roomWidth // 2) - 2 <= x <= (roomWidth // 2) + 1) and (roomWidth - 10 <= y <= roomHeight)) or ((10 <= x <= roomWidth - 11) and (10 <= y <= roomWidth - 11)):
-                    objects.append((floor, Coord(y,x)))
-                else:
-                    objects.append((background, Coord(y,x)))
-
-        objects.append((MapObject("message", False, 10), Coord(28, 23)))
-
-        for i in range(6):
-            for j in range(7):
-                path = str("tile/background/festgrid/row-"+ str(i+1) +"-column-" + str(j+1))
-                objects.append((MapObject(path, True, 1), Coord( ((4*i)+2), ((4*j)+2) )))
-                if i == 1:
-                    objects.append((MapObject(f"fest-foreground-{j+1}", True, 10), Coord(23, (4*j) + 3)))
+        objects.extend(self.static_layout())
 
         return objects
 
     def update(self):
+        started = time.perf_counter()
         messages = []
-        self.clock_two = not self.clock_two
+        now = self.scheduler.now()
+        broadcast = self.scheduler.broadcast_due(now)
+        published = False
+
+        ## changes are coalesced until the scheduler lets a new state out.
+        ## It is rendered into the other slot, so it never clobbers the mix being played
+        fingerprint = self.active_tiles.fingerprint()
+        if fingerprint != self.broadcast_fingerprint:
+            self.scheduler.note_change(now)
+            if broadcast and self.scheduler.render_due(now):
+                self.active_tiles.next_slot()
+                self.broadcast_fingerprint = fingerprint
+                published = True
+
+        ## an unpublished state is held back, except from joining players who have nothing yet
+        send = broadcast and fingerprint == self.broadcast_fingerprint
+        ## clients cannot report a rejected delta, so they are periodically resynchronized with a snapshot
+        keyframe = False
+        if send:
+            self.broadcasts += 1
+            keyframe = self.broadcasts % KEYFRAME_INTERVAL == 0
+        ## clients get a tick to render a state before it is played
+        play = self.playing and not published and self.scheduler.play_due(now)
 
 
         ## holy shit this code needs to be cleaned. It just needs to work rn tho.
+        version = self.active_tiles.version()
         for player in self.get_clients():
+            outbox = self.outbox_for(player)
 
             if player in self.player_load_queue:
-                for path in SOUND_FILEPATHS:
-                    messages.append(SoundMessage(player, path[6:], 0.0))
-
-
-                messages.append(self.active_tiles.add_recipient(player))
-                self.player_load_queue.remove(player)
-            elif self.active_tiles.dirty and self.clock_two:
+                ## receiving a SoundMessage is what makes the client download the file into rsrc_cache
+                ## the server cannot see rsrc_cache, so every join gets every asset: one message once the bank is built
+                for path in self.asset_paths():
+                    outbox.offer("preload " + path, SoundMessage(player, path[6:], 0.0))
+
+
+                ## a joining player always starts from a full snapshot
+                outbox.offer("state", self.active_tiles.add_recipient(player),
+                             partial(self.mark_sent, player.get_name(), version))
+                self.player_load_queue.discard(player)
+            elif keyframe:
+                ## the snapshot payload is cached and shared, so this costs one envelope per player
+                outbox.offer("state", self.active_tiles.add_recipient(player),
+                             partial(self.mark_sent, player.get_name(), version))
+            elif send and self.acknowledged.get(player.get_name()) != version:
                 #print("Sending Fest_message", self.active_tiles)
-                messages.append(self.active_tiles.add_recipient(player))
+                ## only what changed since the version this player last received. Until it is sent, newer
+                ## versions replace it in the player's slot, and are still built from that same base
+                outbox.offer("state", self.active_tiles.add_recipient(player, self.acknowledged.get(player.get_name())),
+                             partial(self.mark_sent, player.get_name(), version), key=version)
 
-            elif self.active_tiles.dirty:
+            elif play and self.acknowledged.get(player.get_name()) == version:
+                ## only a player that has been sent the current slot is told to play it
                 #print("Playing sound")
-                messages.append(SoundMessage(player,"fest/output.wav", 0.5))
+                outbox.offer("play", SoundMessage(player, self.active_tiles.get_slot(), 0.5))
+
+            messages.extend(outbox.drain(now))
+
+        ## tiles are not polled here: moves, joins and leaves update them, see move() and add_player()
 
-            tile_id , tile, _ = self.tile_map.check_player_position(player)
-            if tile_id in {1,2,3,4}:
-                self.active_tiles.add(InstrumentMessage(tile.get_sound_filepath(), tile.get_tile_id(), "".join(str(item) for item in tile.get_stored_sequence())))
+        ## every recipient has the current state, stop re-broadcasting it
+        if self.active_tiles.dirty and all(
+                self.acknowledged.get(player.get_name()) == self.active_tiles.version() for player in self.get_clients()):
+            self.active_tiles.dirty = False
 
+        duration = time.perf_counter() - started
+        self.scheduler.end_tick(duration)
+        if METRICS.enabled:
+            self.record_tick(duration, messages)
         return messages
 
+    def outbox_for(self, player: "Player") -> ClientOutbox:
+        outbox = self.outboxes.get(player.get_name())
+        if outbox is None:
+            ## a state counts as consumed once the client had as long as a re-render may take
+            outbox = self.outboxes[player.get_name()] = ClientOutbox(settle_time=self.scheduler.min_render_interval)
+        return outbox
+
+    def mark_sent(self, name: str, version: int):
+        """ The connection is reliable and clients have no reply channel: sent counts as acknowledged. """
+        self.acknowledged[name] = version
+
+    def record_tick(self, duration: float, messages: list[Message]):
+        """ Per-tick metrics, only called while METRICS is enabled. """
+        METRICS.observe("tick.seconds", duration)
+        METRICS.observe("tick.backoff", self.scheduler.backoff, (1, 2, 4, 8))
+        METRICS.observe("tick.players", len(self.get_clients()), COUNT_BOUNDS)
+        for message in messages:
+            METRICS.inc("messages." + type(message).__name__)
+        METRICS.tick()
+
 
 
 
+    @staticmethod
+    def has_sound_bank() -> bool:
+        """ Whether funfest/sound_bank.py has packed the fest assets into resources/. """
+        return os.path.exists(os.path.join(RESOURCES, BANK_FILEPATH))
+
+    def asset_paths(self) -> list[str]:
+        """ The assets clients need: the packed bank when it has been built, else every wav. """
+        return [BANK_FILEPATH] if self.has_sound_bank() else SOUND_FILEPATHS
+
     def add_player(self, player: "Player", entry_point = None) -> None:
 
 
         self.active_tiles.make_dirty()
-        self.player_load_queue.append(player)
+        self.playing = True
+        self.player_load_queue.add(player)
 
 
         Map.add_player(self, player, entry_point)
+        self.tile_map.check_player_position(player)
+
+    def remove_player(self, player: "Player") -> None:
+        self.tile_map.remove_player(player)
+        self.player_load_queue.discard(player)
+        self.acknowledged.pop(player.get_name(), None)
+        self.outboxes.pop(player.get_name(), None)
+
+        Map.remove_player(self, player)
 
 
 
@@ -147,9 +287,6 @@ class FunFestHouse(Map):
         if tile_id is not None:
             messages.append(ServerMessage(player, f"DEBUG: Player {player.get_name()} is in Tile {tile_id}"))
 
-            print(tile.is_number_sequence_tile)
-            print(tile_id)
-
         return messages
 
 
@@ -169,7 +306,6 @@ class FunFestHouse(Map):
         tile_id = tile.get_tile_id()
 
         self.active_tiles.remove_tile(tile_id)
-        print(f"Removed loop for tile {tile_id} because {player.get_name()} left it.")
 
 
     class Observer:
@@ -0,0 +1,157 @@
+"""
+Benchmarks for the fest audio pipeline: get_timed_sequence, parse and render with 1, 4, 8 and 17 children.
+
+Fixtures are synthetic 16bit mono wav files, generated in a temporary rsrc_cache. Every case records
+wall time (best and median of the repeats) and peak traced memory, and the results are written as
+JSON lines to bench_output.txt, so a regression in the mixing hot path shows up in review.
+
+Run from the folder that contains this package:
+    python -m <package>.test.bench_fest_audio [--repeat 5] [--output bench_output.txt] [--backend array]
+"""
+import os
+import sys
+import json
+import time
+import wave
+import struct
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+from .. import FestSoundCombiner
+from ..FestSoundCombiner import FRAMERATE, SAMPLE_LENGTH
+from ..funfest import render_engine
+from ..funfest.render_engine import MixBus
+from ..funfest.pcm_cache import PCM_CACHE
+from ..funfest.stem_cache import StemCache
+from ..funfest.stem_pool import StemPool
+from ..funfest.fest_codec import encode_submessage
+from ..funfest.sound_assets import SOUND_FILEPATHS, INSTRUMENT_FILEPATHS
+
+CHILD_COUNTS = [1, 4, 8, 17]
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench_output.txt")
+
+
+def write_fixtures(root: str):
+    """ One synthetic asset per SOUND_FILEPATHS entry: 8 note scales for instruments, one bar for loops. """
+    for n, path in enumerate(SOUND_FILEPATHS):
+        length = 16 * FRAMERATE if path in INSTRUMENT_FILEPATHS else SAMPLE_LENGTH
+        samples = struct.pack("<" + "h" * length, *(((i * (n + 3)) % 20000) - 10000 for i in range(length)))
+
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with wave.open(os.path.join(root, path), "wb") as output:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(FRAMERATE)
+            output.writeframes(samples)
+
+
+def fest_message(children: int, sequence: str = "13572468") -> dict:
+    """ Payload shaped like FestMessage._get_data: the backing track, then tiles 1 to 16. """
+    message = {"len": children, "classname": "FestMessage", "0": encode_submessage("loop", -1, "sound/fest/backing_track.wav")}
+    for tile_id in range(1, children):
+        path = SOUND_FILEPATHS[tile_id - 1]
+        if path in INSTRUMENT_FILEPATHS:
+            message[str(tile_id)] = encode_submessage("instrument", tile_id, path, sequence[:tile_id + 1])
+        else:
+            message[str(tile_id)] = encode_submessage("loop", tile_id, path)
+    return message
+
+
+def reset_caches():
+    """ Cold start: nothing decoded, memoized or mixed yet. """
+    PCM_CACHE.clear()
+    FestSoundCombiner._written_stems.clear()
+    FestSoundCombiner.STEM_CACHE = StemCache(max_disk_bytes=0)
+    FestSoundCombiner._MIX_BUS = MixBus()
+
+
+def measure(name: str, function, repeat: int, setup=None, **fields) -> dict:
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    result = {"name": name, **fields, "repeat": repeat, "best_s": min(times),
+              "median_s": statistics.median(times), "peak_bytes": peak}
+    return result
+
+
+def run(repeat: int) -> list[dict]:
+    results = []
+    FestSoundCombiner.STEM_POOL = StemPool(workers=1)
+
+    results.append(measure("get_timed_sequence", lambda: [FestSoundCombiner.get_timed_sequence(n) for n in range(9)],
+                           repeat * 100))
+
+    instrument = ["instrument", "1", "sound/fest/i1.wav", "13572468"]
+    results.append(measure("parse", lambda: FestSoundCombiner.parse(instrument), repeat, setup=reset_caches, cache="cold"))
+    results.append(measure("parse", lambda: FestSoundCombiner.parse(instrument), repeat, cache="warm"))
+
+    for children in CHILD_COUNTS:
+        message = fest_message(children)
+        results.append(measure("render", lambda: FestSoundCombiner.render(message), repeat,
+                               setup=reset_caches, children=children, cache="cold"))
+        results.append(measure("render", lambda: FestSoundCombiner.render(message), repeat,
+                               children=children, cache="warm"))
+
+        ## one instrument tile changing its sequence while everything else stays
+        states = [fest_message(children, "13572468"), fest_message(children, "86427531")]
+
+        def toggle():
+            states.reverse()
+            FestSoundCombiner.render(states[0])
+
+        results.append(measure("render", toggle, repeat, children=children, cache="one_tile_changed"))
+
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the fest audio pipeline.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--backend", default=None, choices=render_engine.available_backends(),
+                        help="render engine backend to benchmark, defaults to the selected one")
+    args = parser.parse_args(argv)
+    if args.backend:
+        FestSoundCombiner.set_render_backend(args.backend)
+
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        write_fixtures(os.path.join(root, "rsrc_cache"))
+        os.chdir(root)
+        try:
+            ## keep the pipeline's warnings out of the timings
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            try:
+                results = run(args.repeat)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        finally:
+            os.chdir(directory)
+
+    environment = {"python": platform.python_version(), "backend": render_engine.get_backend().name}
+    with open(args.output, "w") as output:
+        for result in results:
+            output.write(json.dumps({**environment, **result}) + "\n")
+    for result in results:
+        fields = {key: value for key, value in result.items() if key in ("children", "cache")}
+        print(f"{result['name']:<20} {json.dumps(fields):<40} best {result['best_s'] * 1000:9.2f} ms"
+              f"   peak {result['peak_bytes'] / 1024:9.0f} KiB")
+    print("Wrote", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import pytest
+from unittest.mock import MagicMock
+
+from ..funfest.fest_message import FestMessage, InstrumentMessage, LoopMessage
+
+
+@pytest.fixture
+def fest_message():
+    return FestMessage(MagicMock())
+
+
+def test_add_update_and_remove_by_tile_id(fest_message):
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    fest_message.add(InstrumentMessage("sound/fest/i1.wav", 1, "12"))
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    assert fest_message.length() == 3
+
+    fest_message.add(InstrumentMessage("sound/fest/i1.wav", 1, "123"))
+    assert fest_message._get_data()["2"] == "i1:0:123"
+
+    fest_message.remove_tile(10)
+    assert [child.get_id() for child in fest_message] == [-1, 1]
+
+    fest_message.clear()
+    assert fest_message.length() == 0
+
+
+def test_payload_is_cached_until_a_mutation(fest_message):
+    payload = fest_message._get_data()
+    fest_message.add(LoopMessage("sound/fest/backing_track.wav", -1))
+    assert fest_message._get_data() is payload
+
+    fest_message.add(InstrumentMessage("sound/fest/i2.wav", 2, "4"))
+    assert fest_message._get_data() is not payload
+    assert fest_message._get_data()["len"] == 2
+
+
+def test_fingerprint_ignores_child_order(fest_message):
+    other = FestMessage(MagicMock())
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    fest_message.add(LoopMessage("sound/fest/drum1.wav", 13))
+    other.add(LoopMessage("sound/fest/drum1.wav", 13))
+    other.add(LoopMessage("sound/fest/bass.wav", 10))
+
+    assert fest_message.fingerprint() == other.fingerprint()
+    other.remove_tile(13)
+    assert fest_message.fingerprint() != other.fingerprint()
+
+
+def test_recipients_get_deltas_from_their_version(fest_message):
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    fest_message.add(InstrumentMessage("sound/fest/i1.wav", 1, "12"))
+    base = fest_message.version()
+
+    fest_message.add(InstrumentMessage("sound/fest/i1.wav", 1, "123"))
+    fest_message.remove_tile(10)
+    fest_message.add(LoopMessage("sound/fest/drum1.wav", 13))
+
+    delta = fest_message.add_recipient(MagicMock(), base)._get_data()
+    assert delta["kind"] == "delta" and delta["base"] == base and delta["version"] == fest_message.version()
+    assert delta["updated.1"] == "i1:0:123"
+    assert delta["added.13"] == "l13:12"
+    assert delta["removed"] == "10"
+
+    ## joining players, and ones behind the history, get a snapshot. Joining ones with the path table
+    assert fest_message.add_recipient(MagicMock())._get_data()["kind"] == "snapshot"
+    assert "paths" in fest_message.add_recipient(MagicMock())._get_data() and "paths" not in delta
+    assert fest_message.payload_for(-100)["kind"] == "snapshot"
+
+
+def test_recipients_share_one_serialized_payload(fest_message):
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    base = fest_message.version()
+    fest_message.add(InstrumentMessage("sound/fest/i1.wav", 1, "12"))
+
+    envelopes = [fest_message.add_recipient(MagicMock(), base) for _ in range(3)]
+    assert all(envelope._get_data() is envelopes[0]._get_data() for envelope in envelopes)
+    assert fest_message.add_recipient(MagicMock())._get_data() is fest_message.add_recipient(MagicMock())._get_data()
+    ## envelopes are not states of their own, the shared children are untouched
+    assert fest_message.length() == 3
+
+
+def test_slot_change_reaches_players_that_have_the_state(fest_message):
+    fest_message.add(LoopMessage("sound/fest/bass.wav", 10))
+    joined = fest_message.version()
+    fingerprint = fest_message.fingerprint()
+
+    slot = fest_message.next_slot()
+    assert fest_message.version() == joined + 1 and fest_message.fingerprint() == fingerprint
+
+    delta = fest_message.payload_for(joined)
+    assert delta["slot"] == slot and delta["removed"] == ""
+    assert not [key for key in delta if key.startswith(("added.", "updated."))]
@@ -0,0 +1,52 @@
+from ..funfest.fest_scheduler import FestScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def test_changes_within_the_window_are_published_once():
+    clock = FakeClock()
+    scheduler = FestScheduler(coalesce_window=0.25, min_render_interval=1.0, clock=clock)
+
+    published = []
+    for step in range(20):
+        clock.time = step * 0.1
+        if step < 3:
+            scheduler.note_change(clock.time)
+        if scheduler.render_due(clock.time):
+            published.append(clock.time)
+
+    ## the burst from 0.0 to 0.2 goes out once, after the window
+    assert published == [3 * 0.1]
+
+
+def test_minimum_render_interval_and_broadcast_rate():
+    clock = FakeClock()
+    scheduler = FestScheduler(broadcast_interval=0.5, coalesce_window=0, min_render_interval=1.0, clock=clock)
+    scheduler.note_change(0.0)
+    assert scheduler.render_due(0.0)
+    scheduler.note_change(0.2)
+    assert not scheduler.render_due(0.5)
+    assert scheduler.render_due(1.0)
+
+    assert [scheduler.broadcast_due(step / 10) for step in range(11)].count(True) == 3
+
+
+def test_slow_ticks_back_off_and_recover():
+    scheduler = FestScheduler(broadcast_interval=0.5, tick_budget=0.01, max_backoff=4.0, clock=FakeClock())
+    for _ in range(5):
+        scheduler.end_tick(0.05)
+    assert scheduler.backoff == 4.0
+
+    assert scheduler.broadcast_due(0.0)
+    assert not scheduler.broadcast_due(1.9)
+    assert scheduler.broadcast_due(2.0)
+
+    scheduler.end_tick(0.001)
+    scheduler.end_tick(0.001)
+    assert scheduler.backoff == 1.0
@@ -0,0 +1,356 @@
+import os
+import struct
+import wave
+import pytest
+
+from .. import FestSoundCombiner
+from ..FestSoundCombiner import FRAMERATE, SAMPLE_LENGTH
+from ..funfest.pcm_cache import PCMCache
+from ..funfest.fest_codec import FestState, fingerprint, encode_submessage, decode_submessage, encode_paths
+from ..funfest.stem_cache import StemCache
+from ..funfest.note_index import get_note_index
+from ..funfest.sound_bank import SoundBank, build_bank
+from ..funfest.stem_pool import StemPool
+from ..funfest import render_engine, note_index, fest_codec
+from ..funfest.render_engine import MixBus
+from ..funfest.metrics import Metrics
+
+
+def write_wav(path, samples):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, "wb") as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(FRAMERATE)
+        output.writeframes(struct.pack("<" + "h" * len(samples), *samples))
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as current:
+        frames = current.readframes(current.getnframes())
+    return list(struct.unpack("<" + "h" * (len(frames) // 2), frames))
+
+
+@pytest.fixture
+def rsrc_cache(tmp_path, monkeypatch):
+    # renders read and write relative to the client's working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(FestSoundCombiner, "STEM_CACHE", StemCache())
+    monkeypatch.setattr(FestSoundCombiner, "_MIX_BUS", MixBus())
+    monkeypatch.setattr(FestSoundCombiner, "_last_mix", {"hash": None, "frames": b"", "published": set()})
+    monkeypatch.setattr(FestSoundCombiner, "_FEST_STATE", FestState())
+    write_wav("rsrc_cache/sound/fest/backing_track.wav", [(i % 200) * 100 - 10000 for i in range(SAMPLE_LENGTH)])
+    write_wav("rsrc_cache/sound/fest/bass.wav", [30000 if i % 2 else -30000 for i in range(SAMPLE_LENGTH)])
+    # one frame short, like guitar1.wav
+    write_wav("rsrc_cache/sound/fest/guitar1.wav", [1234] * (SAMPLE_LENGTH - 1))
+    # 8 notes, 2 seconds each
+    write_wav("rsrc_cache/sound/fest/i1.wav", [note * 1000 for note in range(1, 9) for _ in range(2 * FRAMERATE)])
+    return tmp_path
+
+
+@pytest.mark.parametrize("backend", render_engine.available_backends())
+def test_backends_agree_with_reference(backend):
+    stems = [struct.pack("<" + "h" * SAMPLE_LENGTH, *([32767] * SAMPLE_LENGTH)),
+             struct.pack("<" + "h" * 100, *range(-50, 50)),
+             struct.pack("<" + "h" * SAMPLE_LENGTH, *((i * 7919) % 65536 - 32768 for i in range(SAMPLE_LENGTH)))]
+    assert render_engine.compare_backends(stems, 3, backend) <= 1
+    # clipping mixes are scaled down to the peak
+    assert render_engine.compare_backends(stems[:1] * 3, 1, backend) <= 1
+
+
+def test_mix_pads_short_stems():
+    frames = FestSoundCombiner.mix([struct.pack("<hh", 300, -300)], 2, backend="array")
+    samples = struct.unpack("<" + "h" * SAMPLE_LENGTH, frames)
+    assert samples[:3] == (150, -150, 0)
+
+
+def test_render_divides_by_message_length(rsrc_cache):
+    FestSoundCombiner.render({"len": 3, "classname": "FestMessage",
+                              "0": "loop,-1,sound/fest/backing_track.wav",
+                              "1": "loop,10,sound/fest/bass.wav",
+                              "2": "loop,11,sound/fest/guitar1.wav"})
+    backing = read_wav("rsrc_cache/sound/fest/backing_track.wav")
+    bass = read_wav("rsrc_cache/sound/fest/bass.wav")
+    output = read_wav("rsrc_cache/sound/fest/output.wav")
+
+    assert len(output) == SAMPLE_LENGTH
+    assert output[0] == int((backing[0] + bass[0] + 1234) / 3)
+    assert output[-1] == int((backing[-1] + bass[-1]) / 3)
+
+
+def test_parse_renders_instrument_sequence(rsrc_cache):
+    path = FestSoundCombiner.parse(["instrument", "1", "sound/fest/i1.wav", "31"])
+    assert path == "fest/1.wav"
+
+    # "31" -> one quarter note of note 3, then note 1 for the rest of the measure
+    output = read_wav("rsrc_cache/sound/" + path)
+    assert output[:FRAMERATE // 4] == [3000] * (FRAMERATE // 4)
+    assert output[FRAMERATE // 4:] == [1000] * (SAMPLE_LENGTH // 8 * 7)
+
+
+def test_pcm_cache_hits_and_invalidates(rsrc_cache):
+    cache = PCMCache()
+    asset = cache.get("rsrc_cache/sound/fest/bass.wav")
+    assert asset.nframes == SAMPLE_LENGTH
+    assert cache.get("rsrc_cache/sound/fest/bass.wav") is asset
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    write_wav("rsrc_cache/sound/fest/bass.wav", [7] * 10)
+    os.utime("rsrc_cache/sound/fest/bass.wav", ns=(0, 0))
+    assert cache.get("rsrc_cache/sound/fest/bass.wav").nframes == 10
+    assert cache.misses == 2
+
+
+def test_pcm_cache_evicts_least_recently_used(rsrc_cache):
+    cache = PCMCache(max_bytes=2 * SAMPLE_LENGTH * 2)
+    cache.get("rsrc_cache/sound/fest/bass.wav")
+    cache.get("rsrc_cache/sound/fest/backing_track.wav")
+    cache.get("rsrc_cache/sound/fest/bass.wav")
+    cache.get("rsrc_cache/sound/fest/guitar1.wav")
+
+    assert "rsrc_cache/sound/fest/backing_track.wav" not in cache
+    assert "rsrc_cache/sound/fest/bass.wav" in cache
+    assert cache.evictions == 1
+
+
+def test_unchanged_instrument_stems_are_memoized(rsrc_cache):
+    message = ["instrument", "1", "sound/fest/i1.wav", "1234"]
+    first = FestSoundCombiner.build_instrument(message)
+    assert FestSoundCombiner.build_instrument(message) is first
+    assert FestSoundCombiner.STEM_CACHE.stats()["hits"] == 1
+
+    # a fresh process finds the stem on disk
+    cache = StemCache()
+    key = FestSoundCombiner.stem_key("rsrc_cache/sound/fest/i1.wav", "1234", FRAMERATE)
+    assert cache.get_or_render(key, lambda: pytest.fail("stem rendered twice")) == first
+    assert cache.disk_hits == 1
+
+
+def test_stem_cache_respects_disk_cap(rsrc_cache):
+    cache = StemCache(max_memory_bytes=0, max_disk_bytes=10)
+    cache.get_or_render("a", lambda: b"123456")
+    cache.get_or_render("b", lambda: b"789012")
+
+    assert sorted(os.listdir(cache.directory)) == ["b.pcm"]
+    assert cache.get_or_render("a", lambda: b"changed") == b"changed"
+
+
+def test_incremental_render_matches_full_remix(rsrc_cache):
+    backing = "loop,-1,sound/fest/backing_track.wav"
+    bass = "loop,10,sound/fest/bass.wav"
+    instrument = "instrument,1,sound/fest/i1.wav,{}"
+    states = [[backing], [backing, bass], [backing, bass, instrument.format("12")],
+              [backing, instrument.format("812")], [backing, instrument.format("3")]]
+
+    for children in states:
+        message = {"len": len(children), "classname": "FestMessage"}
+        message.update({str(i): child for i, child in enumerate(children)})
+        FestSoundCombiner.render(message)
+        incremental = read_wav("rsrc_cache/sound/fest/output.wav")
+
+        FestSoundCombiner._MIX_BUS.reset()
+        FestSoundCombiner.render(message)
+        assert incremental == read_wav("rsrc_cache/sound/fest/output.wav")
+
+    assert FestSoundCombiner._MIX_BUS.stem_ids() == {"-1", "1"}
+
+
+def test_streaming_render_matches_bus_and_repeats_bars(rsrc_cache, monkeypatch):
+    message = {"len": 3, "classname": "FestMessage",
+               "0": "loop,-1,sound/fest/backing_track.wav",
+               "1": "loop,11,sound/fest/guitar1.wav",
+               "2": "instrument,1,sound/fest/i1.wav,4321"}
+    FestSoundCombiner.render(message)
+    bar = read_wav("rsrc_cache/sound/fest/output.wav")
+
+    FestSoundCombiner.render_stream(message, bars=3, block_frames=1000, path="stream.wav")
+    assert read_wav("stream.wav") == bar * 3
+
+    monkeypatch.setattr(render_engine, "_default", "array")
+    FestSoundCombiner.render_stream(message, block_frames=30000, path="stream.wav")
+    assert read_wav("stream.wav") == bar
+
+
+def test_render_publishes_into_message_slot(rsrc_cache):
+    FestSoundCombiner.render({"len": 1, "classname": "FestMessage", "slot": "fest/output-0.wav",
+                              "0": "loop,-1,sound/fest/backing_track.wav"})
+    FestSoundCombiner.render({"len": 1, "classname": "FestMessage", "slot": "fest/output-1.wav",
+                              "0": "loop,10,sound/fest/bass.wav"})
+
+    assert read_wav("rsrc_cache/sound/fest/output-0.wav") == read_wav("rsrc_cache/sound/fest/backing_track.wav")
+    assert read_wav("rsrc_cache/sound/fest/output-1.wav") == read_wav("rsrc_cache/sound/fest/bass.wav")
+    assert not os.path.exists("rsrc_cache/sound/fest/output-1.wav.tmp")
+
+
+def test_note_index_pads_short_notes_and_rejects_bad_degrees(rsrc_cache):
+    # last note 100 frames short, like the shipped samples
+    write_wav("rsrc_cache/sound/fest/i2.wav", [note for note in range(1, 9) for _ in range(2 * FRAMERATE)][:-100])
+    index = get_note_index("rsrc_cache/sound/fest/i2.wav")
+    assert get_note_index("rsrc_cache/sound/fest/i2.wav") is index
+    assert index.short_notes == [8]
+
+    frames = index.build("81", [2 * FRAMERATE, 10])
+    samples = struct.unpack("<" + "h" * (len(frames) // 2), frames)
+    assert samples[2 * FRAMERATE - 101:2 * FRAMERATE + 1] == (8,) + (0,) * 100 + (1,)
+
+    with pytest.raises(ValueError):
+        index.note(9, 1)
+
+
+def test_timed_sequence_is_whole_frames():
+    for num in range(9):
+        timings = FestSoundCombiner.get_timed_sequence(num)
+        assert all(isinstance(timing, int) for timing in timings)
+
+
+def test_sound_bank_normalizes_and_serves_assets(rsrc_cache, monkeypatch):
+    paths = ["sound/fest/i1.wav", "sound/fest/bass.wav", "sound/fest/guitar1.wav"]
+    fixes = build_bank("rsrc_cache", paths=paths)
+    assert fixes == {"sound/fest/i1.wav": [], "sound/fest/bass.wav": [], "sound/fest/guitar1.wav": ["padded 1 frames"]}
+
+    bank = SoundBank("rsrc_cache/sound/fest/fest.bank")
+    assert bank.get("sound/fest/guitar1.wav").nframes == SAMPLE_LENGTH
+    assert bytes(bank.get("sound/fest/bass.wav").frames) == bytes(PCMCache().get("rsrc_cache/sound/fest/bass.wav").frames)
+
+    cache = PCMCache()
+    cache.attach_bank(bank, "rsrc_cache")
+    assert cache.get("rsrc_cache/sound/fest/i1.wav") is bank.get("sound/fest/i1.wav")
+    os.remove("rsrc_cache/sound/fest/bass.wav")
+    assert cache.get("rsrc_cache/sound/fest/bass.wav") is bank.get("sound/fest/bass.wav")
+
+    # a wav edited after the bank was built wins over the bank
+    write_wav("rsrc_cache/sound/fest/i1.wav", [7] * SAMPLE_LENGTH)
+    os.utime("rsrc_cache/sound/fest/i1.wav", ns=(bank.signature[0] + 1, bank.signature[0] + 1))
+    assert bytes(cache.get("rsrc_cache/sound/fest/i1.wav").frames[:2]) == struct.pack("<h", 7)
+    assert not cache.source_signature("rsrc_cache/sound/fest/i1.wav").startswith("bank:")
+
+
+@pytest.fixture
+def client_cache(rsrc_cache, monkeypatch):
+    # a bank attached by _ensure_bank must not outlive the test
+    cache = PCMCache()
+    monkeypatch.setattr(FestSoundCombiner, "PCM_CACHE", cache)
+    monkeypatch.setattr(note_index, "PCM_CACHE", cache)
+    monkeypatch.setattr(FestSoundCombiner, "_bank_signature", None)
+    return cache
+
+
+def test_rebuilt_sound_bank_is_mapped_again(client_cache):
+    cache = client_cache
+    build_bank("rsrc_cache", paths=["sound/fest/bass.wav"])
+    FestSoundCombiner._ensure_bank()
+    first = cache.get("rsrc_cache/sound/fest/bass.wav")
+    FestSoundCombiner._ensure_bank()
+    assert cache.get("rsrc_cache/sound/fest/bass.wav") is first
+
+    write_wav("rsrc_cache/sound/fest/bass.wav", [5] * SAMPLE_LENGTH)
+    build_bank("rsrc_cache", paths=["sound/fest/bass.wav", "sound/fest/i1.wav"])
+    FestSoundCombiner._ensure_bank()
+    assert bytes(cache.get("rsrc_cache/sound/fest/bass.wav").frames[:4]) == struct.pack("<hh", 5, 5)
+
+
+def test_stems_served_by_a_rebuilt_bank_are_rendered_again(client_cache):
+    cache = client_cache
+    message = ["instrument", "1", "sound/fest/i1.wav", "1234"]
+    build_bank("rsrc_cache", paths=["sound/fest/i1.wav"])
+    FestSoundCombiner._ensure_bank()
+    first = FestSoundCombiner.build_instrument(message)
+
+    # only the bank changes, the wav the key used to be derived from stays as it is
+    bank = "rsrc_cache/sound/fest/fest.bank"
+    os.rename(bank, "old.bank")
+    write_wav("bank_source/sound/fest/i1.wav", [-note * 700 for note in range(1, 9) for _ in range(2 * FRAMERATE)])
+    build_bank("bank_source", output=bank, paths=["sound/fest/i1.wav"])
+    FestSoundCombiner._ensure_bank()
+    assert cache.source_signature("rsrc_cache/sound/fest/i1.wav").startswith("bank:")
+    assert FestSoundCombiner.build_instrument(message) != first
+
+
+def test_parallel_stems_match_serial_render(rsrc_cache, monkeypatch):
+    write_wav("rsrc_cache/sound/fest/i2.wav", [-note * 900 for note in range(1, 9) for _ in range(2 * FRAMERATE)])
+    message = {"len": 4, "classname": "FestMessage",
+               "0": "loop,-1,sound/fest/backing_track.wav",
+               "1": "instrument,1,sound/fest/i1.wav,1357",
+               "2": "instrument,2,sound/fest/i2.wav,864",
+               "3": "instrument,3,sound/fest/i1.wav,2"}
+
+    monkeypatch.setattr(FestSoundCombiner, "STEM_POOL", StemPool(workers=1))
+    FestSoundCombiner.render(message)
+    serial = read_wav("rsrc_cache/sound/fest/output.wav")
+
+    pool = StemPool(workers=2, threshold=2)
+    monkeypatch.setattr(FestSoundCombiner, "STEM_POOL", pool)
+    monkeypatch.setattr(FestSoundCombiner, "STEM_CACHE", StemCache(directory="parallel_stems"))
+    monkeypatch.setattr(FestSoundCombiner, "_MIX_BUS", MixBus())
+    try:
+        FestSoundCombiner.render(message)
+    finally:
+        pool.shutdown()
+    assert read_wav("rsrc_cache/sound/fest/output.wav") == serial
+    assert FestSoundCombiner.STEM_CACHE.misses == 3
+
+
+def test_matching_fingerprint_skips_the_mix(rsrc_cache, monkeypatch):
+    message = {"len": 1, "classname": "FestMessage", "slot": "fest/output-0.wav", "hash": "abc",
+               "0": "loop,-1,sound/fest/backing_track.wav"}
+    FestSoundCombiner.render(message)
+
+    def collect(message):
+        pytest.fail("an unchanged state was mixed again")
+    monkeypatch.setattr(FestSoundCombiner, "_collect_stems", collect)
+
+    FestSoundCombiner.render(message)
+    FestSoundCombiner.render(dict(message, slot="fest/output-1.wav"))
+    assert read_wav("rsrc_cache/sound/fest/output-1.wav") == read_wav("rsrc_cache/sound/fest/output-0.wav")
+
+
+def test_deltas_apply_on_top_of_the_last_snapshot(rsrc_cache, monkeypatch):
+    loop, bass = "loop,-1,sound/fest/backing_track.wav", "loop,10,sound/fest/bass.wav"
+    instrument = "instrument,1,sound/fest/i1.wav,1"
+    FestSoundCombiner.render({"kind": "snapshot", "version": 3, "len": 2, "classname": "FestMessage",
+                              "0": loop, "1": bass, "hash": fingerprint([loop, bass])})
+
+    rendered = []
+    monkeypatch.setattr(FestSoundCombiner, "_render_state", lambda message, checkpoint=None: rendered.append(message))
+    delta = {"kind": "delta", "base": 3, "version": 5, "removed": "10", "added.1": instrument,
+             "hash": fingerprint([loop, instrument])}
+    FestSoundCombiner.render(delta)
+    assert sorted(rendered[0][str(i)] for i in range(rendered[0]["len"])) == [instrument, loop]
+
+    ## replaying it is a gap now, and is dropped without touching the state
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(fest_codec, "METRICS", metrics)
+    FestSoundCombiner.render(delta)
+    assert len(rendered) == 1 and FestSoundCombiner._FEST_STATE.version == 5
+    assert metrics.counters["fest.delta_rejected"] == 1
+
+
+def test_compact_submessages_decode_to_the_same_mix(rsrc_cache):
+    children = [("loop", -1, "sound/fest/backing_track.wav", None), ("loop", 11, "sound/fest/guitar1.wav", None),
+                ("instrument", 1, "sound/fest/i1.wav", "13572468")]
+    for kind, tile_id, path, sequence in children:
+        expected = [kind, str(tile_id), path] + ([sequence] if sequence else [])
+        assert decode_submessage(encode_submessage(kind, tile_id, path, sequence)) == expected
+
+    legacy = {"len": 3, "classname": "FestMessage", "0": "loop,-1,sound/fest/backing_track.wav",
+              "1": "loop,11,sound/fest/guitar1.wav", "2": "instrument,1,sound/fest/i1.wav,13572468"}
+    FestSoundCombiner.render(legacy)
+    expected = read_wav("rsrc_cache/sound/fest/output.wav")
+
+    compact = {"len": 3, "classname": "FestMessage", "slot": "fest/output-0.wav", "paths": encode_paths()}
+    for i, child in enumerate(children):
+        compact[str(i)] = encode_submessage(*child)
+    assert sum(map(len, (compact[str(i)] for i in range(3)))) < sum(map(len, (legacy[str(i)] for i in range(3)))) // 3
+    FestSoundCombiner.render(compact)
+    assert read_wav("rsrc_cache/sound/fest/output-0.wav") == expected
+
+
+def test_render_time_is_recorded_when_metrics_are_enabled(rsrc_cache, monkeypatch):
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(FestSoundCombiner, "METRICS", metrics)
+    message = {"len": 1, "classname": "FestMessage", "0": "loop,-1,sound/fest/backing_track.wav", "hash": "a"}
+    FestSoundCombiner.render(message)
+    FestSoundCombiner.render(message)
+
+    assert metrics.histograms["render.seconds"].count == 1
+    assert metrics.counters["render.skipped"] == 1
@@ -0,0 +1,93 @@
+from ..imports import *
+from ..funfest_map import FunFestHouse, is_floor, wall_ring
+from ..funfest.sound_assets import SOUND_FILEPATHS
+from ..funfest.fest_message import LoopMessage, KEYFRAME_INTERVAL
+
+
+def layout_at(y: int, x: int) -> list:
+    return [obj for obj, coord in FunFestHouse.static_layout() if (coord.y, coord.x) == (y, x)]
+
+
+def test_only_the_stage_and_corridor_are_walkable():
+    assert not is_floor(0, 0) and is_floor(11, 11) and is_floor(39, 17)
+    ## walls only ring the floor, the black background draws the rest
+    assert layout_at(0, 0) == []
+    assert [obj.is_passable() for obj in layout_at(9, 9)] == [False]
+    assert [obj.is_passable() for obj in layout_at(39, 15)] == [False]
+    assert all(any(not obj.is_passable() for obj in layout_at(y, x)) for y, x in wall_ring())
+    ## cobblestone, and the festgrid overlay placed on the stage
+    assert all(obj.is_passable() for obj in layout_at(11, 11))
+    assert FunFestHouse.static_layout() is FunFestHouse.static_layout()
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def run_until(house, clock, until: float, step: float = 0.1) -> list:
+    messages = []
+    while clock.time < until:
+        clock.time = round(clock.time + step, 3)
+        messages += [(clock.time, message) for message in house.update()]
+    return messages
+
+
+def test_player_joining_before_a_publish_only_plays_slots_it_was_sent():
+    house = FunFestHouse()
+    clock = FakeClock()
+    house.scheduler.clock = clock
+    first, late = HumanPlayer("a"), HumanPlayer("b")
+    house.add_player(first)
+    run_until(house, clock, 2.0)
+
+    ## a change waits in the coalesce window while b joins
+    house.active_tiles.add(LoopMessage("sound/fest/bass.wav", 10))
+    run_until(house, clock, 2.2)
+    house.add_player(late)
+    messages = run_until(house, clock, 8.0)
+
+    slot, played = None, []
+    for _, message in messages:
+        if message.recipient is not late:
+            continue
+        if isinstance(message, SoundMessage):
+            if message.volume > 0:
+                played.append(message.path)
+                assert message.path == slot
+        elif "slot" in message._get_data():
+            slot = message._get_data()["slot"]
+    assert played
+
+
+def test_players_in_sync_still_get_periodic_snapshots():
+    house = FunFestHouse()
+    clock = FakeClock()
+    house.scheduler.clock = clock
+    player = HumanPlayer("a")
+    house.add_player(player)
+    house.scheduler.configure(broadcast_interval=0.5)
+
+    ## nothing changes after the join, a client that dropped a delta would otherwise never resync
+    snapshots = [at for at, message in run_until(house, clock, 2 * KEYFRAME_INTERVAL * 0.5 + 1)
+                 if not isinstance(message, SoundMessage) and message._get_data().get("kind") == "snapshot"]
+    assert len(snapshots) >= 3
+
+
+def test_joining_players_are_sent_each_asset_as_a_sound_message():
+    house = FunFestHouse()
+    player = HumanPlayer("a")
+    house.add_player(player)
+
+    def assets(messages):
+        return [message.path for message in messages if isinstance(message, SoundMessage) and message.volume == 0.0]
+
+    assert assets(house.update()) == [path[6:] for path in SOUND_FILEPATHS]
+
+    ## the server cannot tell whether a returning player still has them, so it sends them again
+    house.remove_player(player)
+    house.add_player(player)
+    assert assets(house.update()) == [path[6:] for path in SOUND_FILEPATHS]
@@ -1,4 +1,4 @@
-from .imports import *
+from ..imports import *
 import pytest
 from unittest.mock import MagicMock, patch
 from typing import TYPE_CHECKING
@@ -69,3 +69,51 @@ def test_tile_filepath_for_multiple_positions(setup_test_environment):
         args = mock_observer.notify_tile_activation.call_args[0]
         assert args[0].get_sound_filepath() == expected_path
 
+
+def test_unchanged_position_is_answered_from_the_cache(setup_test_environment):
+    player, tile_map, mock_observer = setup_test_environment
+    player.get_current_position = MagicMock(return_value=Coord(11, 11))
+    tile_map.check_player_position(player)
+
+    tile_map.tiles = {}
+    assert tile_map.check_player_position(player)[0] == 1
+    assert tile_map.get_player_tile(player)[0] == 1
+    mock_observer.notify_tile_activation.assert_called_once()
+
+def test_removed_player_leaves_their_tile(setup_test_environment):
+    player, tile_map, mock_observer = setup_test_environment
+    player.get_current_position = MagicMock(return_value=Coord(15, 15))
+    tile_map.check_player_position(player)
+
+    tile_map.remove_player(player)
+    assert mock_observer.notify_tile_deactivation.call_args[0][0].get_tile_id() == 6
+    mock_observer.remove_tile_loop.assert_called_once()
+    assert player.get_name() not in tile_map.current_tile_for_player
+
+def test_rooms_share_tile_geometry_but_not_sequences(setup_test_environment):
+    player, tile_map, _ = setup_test_environment
+    other_room = TileMap(10, 10, 4)
+    tile = tile_map.tiles[((10, 10), (13, 13))]
+    assert other_room.tiles[((10, 10), (13, 13))] is tile
+
+    tile_map.store_number(tile, 3)
+    assert tile_map.get_stored_sequence(tile) == [3]
+    assert other_room.get_stored_sequence(tile) == []
+    with pytest.raises(AttributeError):
+        tile.sound_path = "sound/fest/bass.wav"
+
+def test_large_grid_lookup_matches_tile_bounds():
+    tile_map = TileMap(0, 5, tile_size=3, rows=12, cols=20)
+    assert len(tile_map.tiles) == 240
+
+    for (top_left, bottom_right), tile in tile_map.tiles.items():
+        assert tile_map.tile_at(*top_left) is tile
+        assert tile_map.tile_at(*bottom_right) is tile
+    assert tile_map.tile_at(0, 4) is None and tile_map.tile_at(36, 5) is None
+    ## sounds repeat once the grid has more tiles than sounds
+    assert tile_map.tile_at(0, 5).get_sound_filepath() == tile_map.grid[16].get_sound_filepath()
+    assert tile_map.grid[16].is_number_sequence_tile
+
+def test_tile_sounds_outside_the_path_table_are_rejected():
+    with pytest.raises(ValueError):
+        TileMap(10, 10, 4, sound_paths=["sound/fest/not_in_the_table.wav"])
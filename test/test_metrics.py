@@ -0,0 +1,27 @@
+from ..funfest.metrics import Metrics
+
+
+def test_counters_histograms_and_periodic_export():
+    metrics = Metrics(interval=0)
+    exported = []
+    metrics.configure(enabled=True, callback=exported.append)
+
+    metrics.inc("messages.SoundMessage")
+    metrics.inc("messages.SoundMessage", 2)
+    for value in (0.0001, 0.003, 2.0):
+        metrics.observe("tick.seconds", value)
+    metrics.tick()
+
+    snapshot = exported[0]
+    assert snapshot["counters"] == {"messages.SoundMessage": 3}
+    tick = snapshot["histograms"]["tick.seconds"]
+    assert (tick["count"], tick["min"], tick["max"]) == (3, 0.0001, 2.0)
+    assert tick["buckets"]["0.0005"] == 1 and tick["buckets"]["0.005"] == 1 and tick["buckets"]["inf"] == 1
+
+
+def test_disabled_metrics_export_nothing():
+    metrics = Metrics()
+    exported = []
+    metrics.configure(interval=0, callback=exported.append)
+    metrics.tick()
+    assert exported == []
@@ -0,0 +1,30 @@
+from ..funfest.outbound import ClientOutbox
+
+
+def test_slow_client_only_gets_the_newest_state():
+    outbox = ClientOutbox(max_in_flight=1, settle_time=1.0)
+    sent = []
+    outbox.offer("state", "v1", lambda: sent.append(1), key=1)
+    assert outbox.drain(0.0) == ["v1"]
+
+    ## the client is still rendering v1: v2 and v3 wait, v3 replaces v2
+    outbox.offer("state", "v2", lambda: sent.append(2), key=2)
+    outbox.offer("play", "play")
+    assert outbox.drain(0.5) == ["play"]
+    outbox.offer("state", "v3", lambda: sent.append(3), key=3)
+    outbox.offer("state", "v3 again", lambda: sent.append(3), key=3)
+    assert outbox.stats() == {"pending": 1, "in_flight": 1, "sent": 2, "dropped": 1}
+
+    assert outbox.drain(1.0) == ["v3"]
+    assert sent == [1, 3]
+
+
+def test_acknowledged_state_frees_the_slot():
+    outbox = ClientOutbox(max_in_flight=1, settle_time=10.0)
+    outbox.offer("state", "v1")
+    outbox.drain(0.0)
+    outbox.offer("state", "v2")
+    assert outbox.drain(0.1) == []
+
+    outbox.acknowledge()
+    assert outbox.drain(0.2) == ["v2"]
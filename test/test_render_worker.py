@@ -0,0 +1,64 @@
+import threading
+import time
+
+from ..funfest import render_worker
+from ..funfest.render_worker import RenderWorker, SCStatus
+from ..funfest.metrics import Metrics
+
+
+def test_bursts_are_coalesced_and_superseded_renders_cancelled():
+    started = threading.Event()
+    release = threading.Event()
+    rendered = []
+
+    def render(message, checkpoint):
+        if message["n"] == 0:
+            started.set()
+            release.wait(1)
+        checkpoint()
+        rendered.append(message["n"])
+
+    worker = RenderWorker(render)
+    worker.submit({"n": 0})
+    started.wait(1)
+    for n in range(1, 5):
+        worker.submit({"n": n})
+    release.set()
+
+    assert worker.wait(2)
+    assert rendered == [4]
+    assert worker.status == SCStatus.COMPLETE
+    assert (worker.superseded, worker.coalesced) == (1, 3)
+    worker.stop()
+
+
+def test_slow_render_times_out():
+    def render(message, checkpoint):
+        while True:
+            time.sleep(0.01)
+            checkpoint()
+
+    worker = RenderWorker(render, timeout=0.05)
+    worker.submit({})
+
+    assert worker.wait(2)
+    assert worker.timed_out == 1
+    assert worker.status == SCStatus.IDLE
+    worker.stop()
+
+
+def test_failed_render_is_counted_and_its_traceback_printed(monkeypatch, capsys):
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(render_worker, "METRICS", metrics)
+
+    def render(message, checkpoint):
+        raise ValueError("broken sample")
+
+    worker = RenderWorker(render)
+    worker.submit({})
+
+    assert worker.wait(2)
+    assert worker.failed == 1 and isinstance(worker.last_error, ValueError)
+    assert metrics.counters["render.failed"] == 1
+    assert "Traceback" in capsys.readouterr().err
+    worker.stop()